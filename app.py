@@ -1,22 +1,368 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, abort, g, has_app_context, has_request_context, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_socketio import SocketIO, emit, join_room, leave_room
+import socketio as socketio_server
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.utils import secure_filename
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from sqlalchemy import create_engine, false, func, case, event, inspect, select, update
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.pool import NullPool, Pool
+from sqlalchemy.schema import CreateColumn
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from xml.sax.saxutils import escape as xml_escape
+import atexit
+import bisect
+import csv
+import io
 import json
 import os
+import re
+import signal
+import sqlite3
+import sys
+import threading
+import time
+import zipfile
+
+# Database performance profiles, selected with CLASSROOM_DB_PROFILE. The
+# pragmas are applied to every new SQLite connection and ignored for other
+# databases; the engine options are passed to SQLAlchemy.
+DB_PROFILES = {
+    # Raspberry Pi on an SD card: WAL lets readers and the writer proceed
+    # together, and synchronous=NORMAL only fsyncs at checkpoints.
+    'pi': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': 5000,
+            'mmap_size': 64 * 1024 * 1024,
+            'cache_size': -16000,  # KiB
+            'temp_store': 'MEMORY'
+        },
+        'engine_options': {'pool_size': 5, 'max_overflow': 10, 'pool_timeout': 10}
+    },
+    'server': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': 10000,
+            'mmap_size': 512 * 1024 * 1024,
+            'cache_size': -131072,  # KiB
+            'temp_store': 'MEMORY'
+        },
+        'engine_options': {'pool_size': 20, 'max_overflow': 40, 'pool_timeout': 10, 'pool_pre_ping': True, 'pool_recycle': 1800}
+    },
+    # SQLite and SQLAlchemy defaults
+    'default': {'pragmas': {}, 'engine_options': {}}
+}
+
+def profile_engine_options(profile, database_uri):
+    options = dict(DB_PROFILES[profile]['engine_options'])
+    url = make_url(database_uri)
+    if url.get_backend_name() == 'sqlite' and (url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory'):
+        # In-memory SQLite is served by a single-connection pool that takes no sizing
+        for option in ('pool_size', 'max_overflow', 'pool_timeout'):
+            options.pop(option, None)
+    return options
 
 app = Flask(__name__)
-app.config['SECRET_KEY'] = 'your-secret-key-change-in-production'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///classroom_app.db'
+app.config['SECRET_KEY'] = os.environ.get('CLASSROOM_SECRET_KEY', 'your-secret-key-change-in-production')
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('CLASSROOM_DATABASE_URI', 'sqlite:///classroom_app.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['DB_PROFILE'] = os.environ.get('CLASSROOM_DB_PROFILE', 'pi')
+if app.config['DB_PROFILE'] not in DB_PROFILES:
+    raise ValueError(f"Unknown CLASSROOM_DB_PROFILE '{app.config['DB_PROFILE']}'")
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = profile_engine_options(app.config['DB_PROFILE'], app.config['SQLALCHEMY_DATABASE_URI'])
+app.config['SHARD_DIR'] = os.environ.get('CLASSROOM_SHARD_DIR')  # one SQLite file per class for session data; unset = one database
+if app.config['SHARD_DIR'] and make_url(app.config['SQLALCHEMY_DATABASE_URI']).get_backend_name() != 'sqlite':
+    raise ValueError('CLASSROOM_SHARD_DIR needs a SQLite CLASSROOM_DATABASE_URI')
+app.config['LIVE_STATS_PUSH_INTERVAL'] = 0.15  # seconds between live_stats_delta batches
+app.config['INTERACTION_FLUSH_INTERVAL'] = 1.0  # seconds between buffered participation writes
+app.config['POLL_RESPONSE_FLUSH_INTERVAL'] = 0.5  # seconds between buffered poll answer writes
+app.config['SOCKET_TOKEN_MAX_AGE'] = 12 * 3600  # seconds a student socket token stays valid
+app.config['SYNC_MAX_EVENTS'] = 500  # queued nameplate events accepted per sync request
+app.config['SYNC_KEY_RETENTION'] = timedelta(days=7)  # how long synced event keys are kept for deduplication
+app.config['RECENT_KEYS_PER_STUDENT'] = 256  # tap idempotency keys remembered per student for retries
+app.config['JOB_POLL_INTERVAL'] = 1.0  # seconds between checks for queued background jobs
+app.config['JOB_STALE_AFTER'] = timedelta(minutes=2)  # a running job without progress for this long is queued again
+app.config['INTERACTION_ROLLUP_DAYS'] = 7  # days of the event log re-counted into Participation when a class stops; older queued events are not synced
+app.config['JOB_CHUNK_SIZE'] = 1000  # rows deleted or archived per transaction by background jobs
+app.config['ARCHIVE_DATABASE_URI'] = os.environ.get('CLASSROOM_ARCHIVE_URI', 'sqlite:///classroom_archive.db')
+app.config['STUDENT_CACHE_SIZE'] = int(os.environ.get('CLASSROOM_STUDENT_CACHE_SIZE', 5000))  # students kept for card logins
+app.config['METRICS_ENABLED'] = os.environ.get('CLASSROOM_METRICS', '').lower() in ('1', 'true', 'yes')
+app.config['SLOW_REQUEST_MS'] = float(os.environ.get('CLASSROOM_SLOW_REQUEST_MS', 0))  # 0 = no slow-request log
 
 db = SQLAlchemy(app)
+
+@event.listens_for(Engine, 'connect')
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma, value in DB_PROFILES[app.config['DB_PROFILE']]['pragmas'].items():
+        cursor.execute(f'PRAGMA {pragma} = {value}')
+    cursor.close()
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
-socketio = SocketIO(app, cors_allowed_origins="*")
+
+# Metrics
+# With CLASSROOM_METRICS on, request and socket event latencies, SQL statements
+# per request, write statement times and emit fan-out are recorded in memory
+# and served at /metrics in the Prometheus text format. CLASSROOM_SLOW_REQUEST_MS
+# logs every request or event slower than that. With both off no hooks are
+# installed.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+def metric_labels(names, values):
+    if not names:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+class Counter:
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def inc(self, *label_values):
+        with self.lock:
+            self.series[label_values] = self.series.get(label_values, 0) + 1
+
+    def render(self):
+        with self.lock:
+            series = sorted(self.series.items())
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        for label_values, value in series:
+            lines.append(f'{self.name}{metric_labels(self.labels, label_values)} {value}')
+        return lines
+
+class Histogram:
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), sum, count
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self.lock:
+            series = sorted((labels, list(counts), total, count) for labels, (counts, total, count) in self.series.items())
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for label_values, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                labels = metric_labels(self.labels + ('le',), label_values + (bound,))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = metric_labels(self.labels, label_values)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+http_request_seconds = Histogram('classroom_http_request_seconds', 'HTTP request latency by route.', ('route', 'method'))
+http_responses = Counter('classroom_http_responses_total', 'HTTP responses by route and status.', ('route', 'method', 'status'))
+socket_event_seconds = Histogram('classroom_socket_event_seconds', 'Socket.IO event handler latency.', ('event',))
+socket_event_errors = Counter('classroom_socket_event_errors_total', 'Socket.IO event handlers that raised.', ('event',))
+request_sql_statements = Histogram('classroom_request_sql_statements', 'SQL statements per request or socket event.',
+                                   ('kind', 'name'), SIZE_BUCKETS)
+request_sql_seconds = Histogram('classroom_request_sql_seconds', 'Time in SQL per request or socket event.', ('kind', 'name'))
+db_write_seconds = Histogram('classroom_db_write_seconds',
+                             'INSERT/UPDATE/DELETE statement time, including waits for the SQLite write lock.',
+                             ('statement',))
+emit_fanout = Histogram('classroom_emit_fanout_sockets', 'Sockets on this worker reached by each emit.',
+                        ('event',), SIZE_BUCKETS)
+METRICS = (http_request_seconds, http_responses, socket_event_seconds, socket_event_errors,
+           request_sql_statements, request_sql_seconds, db_write_seconds, emit_fanout)
+
+def begin_request_metrics():
+    g.metrics_start = time.perf_counter()
+    g.sql_statements = 0
+    g.sql_seconds = 0.0
+
+def end_request_metrics(kind, name):
+    # Records the SQL used by the request and returns its duration
+    elapsed = time.perf_counter() - g.metrics_start
+    if app.config['METRICS_ENABLED']:
+        request_sql_statements.observe(g.sql_statements, kind, name)
+        request_sql_seconds.observe(g.sql_seconds, kind, name)
+    if app.config['SLOW_REQUEST_MS'] and elapsed * 1000 >= app.config['SLOW_REQUEST_MS']:
+        app.logger.warning(f'Slow {kind} {name}: {elapsed * 1000:.0f}ms, '
+                           f'{g.sql_statements} SQL statements in {g.sql_seconds * 1000:.0f}ms')
+    return elapsed
+
+def request_route():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+def before_request_metrics():
+    begin_request_metrics()
+
+def after_request_metrics(response):
+    if 'metrics_start' not in g:
+        return response
+    route = request_route()
+    elapsed = end_request_metrics('http', route)
+    if app.config['METRICS_ENABLED']:
+        http_request_seconds.observe(elapsed, route, request.method)
+        http_responses.inc(route, request.method, response.status_code)
+    return response
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.metrics_start = time.perf_counter()
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, 'metrics_start', None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    verb = statement.lstrip()[:6].upper()
+    if verb in ('INSERT', 'UPDATE', 'DELETE'):
+        db_write_seconds.observe(elapsed, verb)
+    if has_app_context() and 'sql_statements' in g:
+        g.sql_statements += 1
+        g.sql_seconds += elapsed
+
+class InstrumentedSocketIO(SocketIO):
+    """Times every event handler and records how many sockets each emit
+    reaches. Used instead of SocketIO when metrics or the slow-request log
+    are on."""
+    def _handle_event(self, handler, message, namespace, sid, *args):
+        # Connect handlers and acknowledgement callbacks are not timed
+        if message in ('connect', None):
+            return super()._handle_event(handler, message, namespace, sid, *args)
+        
+        def timed_handler(*handler_args):
+            begin_request_metrics()
+            try:
+                return handler(*handler_args)
+            except Exception:
+                if app.config['METRICS_ENABLED']:
+                    socket_event_errors.inc(message)
+                raise
+            finally:
+                elapsed = end_request_metrics('socket', message)
+                if app.config['METRICS_ENABLED']:
+                    socket_event_seconds.observe(elapsed, message)
+        return super()._handle_event(timed_handler, message, namespace, sid, *args)
+
+    def emit(self, event, *args, **kwargs):
+        if app.config['METRICS_ENABLED']:
+            emit_fanout.observe(self.room_size(kwargs.get('namespace') or '/', kwargs.get('to') or kwargs.get('room')), event)
+        return super().emit(event, *args, **kwargs)
+
+    def room_size(self, namespace, room):
+        rooms = self.server.manager.rooms.get(namespace, {})
+        if isinstance(room, (list, tuple, set)):
+            return sum(len(rooms.get(r, ())) for r in room)
+        return len(rooms.get(room, ()))
+
+if app.config['METRICS_ENABLED'] or app.config['SLOW_REQUEST_MS']:
+    app.before_request(before_request_metrics)
+    app.after_request(after_request_metrics)
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    socketio_class = InstrumentedSocketIO
+else:
+    socketio_class = SocketIO
+
+# Socket.IO rooms
+# Each class has one room per audience. Broadcasts go only to the sockets that
+# use them: student activity to the professor's dashboard, display settings
+# to the nameplates, and poll and class lifecycle events to both. Every
+# student socket is also in a room of its own for feedback meant only for it.
+def instructor_room(class_id):
+    return f'class_{class_id}_instructor'
+
+def students_room(class_id):
+    return f'class_{class_id}_students'
+
+def class_rooms(class_id):
+    return [instructor_room(class_id), students_room(class_id)]
+
+def student_room(student_id):
+    return f'student_{student_id}'
+
+# Multi-worker mode
+# With CLASSROOM_MESSAGE_QUEUE set, room broadcasts fan out to every worker
+# through the queue. Changes to live class state travel the same way as a
+# reserved event, which each worker applies to its own copy of the state
+# instead of delivering it to clients.
+LIVE_UPDATE_EVENT = 'live_state_update'
+LIVE_UPDATE_ROOM = 'live_state_updates'
+
+class LiveStateManagerMixin:
+    def _handle_emit(self, message):
+        if message['event'] == LIVE_UPDATE_EVENT:
+            apply_live_update(message['data'])
+        else:
+            super()._handle_emit(message)
+
+class LocalPubSubManager(socketio_server.PubSubManager):
+    """In-process stand-in for the Redis backend: every manager created in
+    this process shares one channel. Used by check_message_queue.py to run two
+    workers in one process; the Flask-SocketIO test client refuses to run
+    with a message queue."""
+    name = 'local'
+    subscribers = {}
+
+    def initialize(self):
+        self.queue = self.server.eio.create_queue()
+        LocalPubSubManager.subscribers.setdefault(self.channel, []).append(self.queue)
+        super().initialize()
+
+    def _publish(self, data):
+        for subscriber in list(LocalPubSubManager.subscribers.get(self.channel, [])):
+            subscriber.put(data)
+
+    def _listen(self):
+        while True:
+            yield self.queue.get()
+
+class LocalLiveStateManager(LiveStateManagerMixin, LocalPubSubManager):
+    pass
+
+class RedisLiveStateManager(LiveStateManagerMixin, socketio_server.RedisManager):
+    pass
+
+class KombuLiveStateManager(LiveStateManagerMixin, socketio_server.KombuManager):
+    pass
+
+def make_client_manager(url):
+    if not url:
+        return None
+    if url.startswith('local://'):
+        return LocalLiveStateManager(channel='classroom')
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisLiveStateManager(url, channel='classroom')
+    return KombuLiveStateManager(url, channel='classroom')
+
+socketio = socketio_class(
+    app,
+    cors_allowed_origins="*",
+    async_mode=os.environ.get('CLASSROOM_ASYNC_MODE') or None,
+    client_manager=make_client_manager(os.environ.get('CLASSROOM_MESSAGE_QUEUE'))
+)
 
 # Database Models
 class Professor(UserMixin, db.Model):
@@ -41,9 +387,13 @@ class Class(db.Model):
     class_code = db.Column(db.String(20), unique=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=False)
+    is_deleted = db.Column(db.Boolean, default=False, nullable=False, server_default=false())  # set until a delete_class job removes it
     professor = db.relationship('Professor', backref=db.backref('classes', lazy=True))
 
 class Enrollment(db.Model):
+    __table_args__ = (
+        db.Index('ix_enrollment_class_student', 'class_id', 'student_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     class_id = db.Column(db.Integer, db.ForeignKey('class.id'), nullable=False)
     student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
@@ -52,6 +402,9 @@ class Enrollment(db.Model):
     student = db.relationship('Student', backref=db.backref('enrollments', lazy=True))
 
 class Attendance(db.Model):
+    __table_args__ = (
+        db.Index('ix_attendance_class_date_student', 'class_id', 'date', 'student_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     class_id = db.Column(db.Integer, db.ForeignKey('class.id'), nullable=False)
     student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
@@ -62,6 +415,9 @@ class Attendance(db.Model):
     student = db.relationship('Student', backref=db.backref('attendances', lazy=True))
 
 class Participation(db.Model):
+    __table_args__ = (
+        db.Index('ix_participation_class_date_student', 'class_id', 'date', 'student_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     class_id = db.Column(db.Integer, db.ForeignKey('class.id'), nullable=False)
     student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
@@ -75,6 +431,9 @@ class Participation(db.Model):
     student = db.relationship('Student', backref=db.backref('participations', lazy=True))
 
 class Poll(db.Model):
+    __table_args__ = (
+        db.Index('ix_poll_class_active', 'class_id', 'is_active'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     class_id = db.Column(db.Integer, db.ForeignKey('class.id'), nullable=False)
     question = db.Column(db.String(500), nullable=False)
@@ -86,6 +445,9 @@ class Poll(db.Model):
     class_obj = db.relationship('Class', backref=db.backref('polls', lazy=True))
 
 class PollResponse(db.Model):
+    __table_args__ = (
+        db.Index('ix_poll_response_poll_student', 'poll_id', 'student_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     poll_id = db.Column(db.Integer, db.ForeignKey('poll.id'), nullable=False)
     student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
@@ -102,6 +464,1017 @@ class ClassSettings(db.Model):
     quiet_mode = db.Column(db.Boolean, default=False)
     class_obj = db.relationship('Class', backref=db.backref('settings', uselist=False))
 
+def settings_dict(settings):
+    # Display settings as sent to nameplates; a class without a row gets the defaults
+    return {
+        'show_first_name_only': bool(settings and settings.show_first_name_only),
+        'quiet_mode': bool(settings and settings.quiet_mode)
+    }
+
+# Every tap, appended as it happens. Participation's daily counters are
+# derived from this log when a class stops, and the timeline is read from it.
+INTERACTION_TYPES = ('hand_raise', 'thumbs_up', 'thumbs_down')
+
+class InteractionEvent(db.Model):
+    __table_args__ = (
+        db.Index('ix_interaction_event_class_time', 'class_id', 'created_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    class_id = db.Column(db.Integer, db.ForeignKey('class.id'), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
+    kind = db.Column(db.SmallInteger, nullable=False)  # index into INTERACTION_TYPES
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+def time_bucket(column, unit):
+    # The minute or day of a timestamp as text, for the configured database
+    if db.engine.dialect.name == 'postgresql':
+        return func.to_char(func.date_trunc(unit, column), 'YYYY-MM-DD HH24:MI' if unit == 'minute' else 'YYYY-MM-DD')
+    return func.strftime('%Y-%m-%d %H:%M' if unit == 'minute' else '%Y-%m-%d', column)
+
+def day_bounds(date):
+    start = datetime.combine(date, datetime.min.time())
+    return start, start + timedelta(days=1)
+
+# Idempotency keys of the events nameplates queued offline and synced, so a
+# batch that is sent again after a lost response is not applied twice.
+class SyncedEvent(db.Model):
+    __table_args__ = (
+        db.Index('ix_synced_event_student_key', 'student_id', 'event_key', unique=True),
+        db.Index('ix_synced_event_received', 'received_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
+    event_key = db.Column(db.String(64), nullable=False)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Work queued for the background job runner
+class Job(db.Model):
+    __table_args__ = (
+        db.Index('ix_job_status', 'status', 'id'),
+        db.Index('ix_job_class', 'class_id', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    class_id = db.Column(db.Integer, nullable=True)  # no foreign key: a job can outlive its class
+    professor_id = db.Column(db.Integer, db.ForeignKey('professor.id'), nullable=True)
+    params = db.Column(db.Text, nullable=True)  # JSON string
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done or failed
+    progress = db.Column(db.Float, default=0.0)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'class_id': self.class_id,
+            'status': self.status,
+            'progress': self.progress,
+            'error': self.error
+        }
+
+# Running totals per (class, student), rolled up one session at a time by
+# update_gradebook so the gradebook never has to rescan the semester.
+GRADE_SUMMARY_FIELDS = (
+    'attendance_count', 'attendance_records', 'participation_days',
+    'peer_grade_total', 'instructor_grade_total',
+    'hand_raises', 'thumbs_up', 'thumbs_down',
+    'poll_correct', 'poll_total'
+)
+
+class GradeSummary(db.Model):
+    __table_args__ = (
+        db.Index('ix_grade_summary_class_student', 'class_id', 'student_id', unique=True),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    class_id = db.Column(db.Integer, db.ForeignKey('class.id'), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
+    sessions_held = db.Column(db.Integer, default=0)
+    attendance_count = db.Column(db.Integer, default=0)
+    attendance_records = db.Column(db.Integer, default=0)
+    participation_days = db.Column(db.Integer, default=0)
+    peer_grade_total = db.Column(db.Float, default=0.0)
+    instructor_grade_total = db.Column(db.Float, default=0.0)
+    hand_raises = db.Column(db.Integer, default=0)
+    thumbs_up = db.Column(db.Integer, default=0)
+    thumbs_down = db.Column(db.Integer, default=0)
+    poll_correct = db.Column(db.Integer, default=0)
+    poll_total = db.Column(db.Integer, default=0)
+    last_session = db.Column(db.Text, nullable=True)  # JSON string: date, window start and totals of the last session rolled up
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    class_obj = db.relationship('Class', backref=db.backref('grade_summaries', lazy=True))
+    student = db.relationship('Student', backref=db.backref('grade_summaries', lazy=True))
+
+    def session_window(self, date):
+        # The dates a rollup on this date counts are those after the returned
+        # date (every date when None): after the previous rollup, so a session
+        # that ran past midnight is counted whole, or the previous rollup's own
+        # dates when that session is rolled up again
+        previous = json.loads(self.last_session) if self.last_session else None
+        if not previous:
+            return None
+        if previous['date'] != date.isoformat():
+            return datetime.strptime(previous['date'], '%Y-%m-%d').date()
+        if 'after' not in previous:
+            return date - timedelta(days=1)  # rolled up before windows were recorded
+        return datetime.strptime(previous['after'], '%Y-%m-%d').date() if previous['after'] else None
+
+    def apply_session(self, date, after, totals):
+        previous = json.loads(self.last_session) if self.last_session else None
+        if previous and previous['date'] == date.isoformat():
+            # The same session is rolled up again (class restarted); replace its totals
+            for field in GRADE_SUMMARY_FIELDS:
+                setattr(self, field, getattr(self, field) - previous[field])
+        else:
+            self.sessions_held += 1
+        for field in GRADE_SUMMARY_FIELDS:
+            setattr(self, field, getattr(self, field) + totals[field])
+        self.last_session = json.dumps({'date': date.isoformat(), 'after': after.isoformat() if after else None, **totals})
+        self.updated_at = datetime.utcnow()
+
+def new_grade_summary(class_id, student_id):
+    return GradeSummary(
+        class_id=class_id,
+        student_id=student_id,
+        sessions_held=0,
+        **dict.fromkeys(GRADE_SUMMARY_FIELDS, 0)
+    )
+
+def dialect_insert(model):
+    # INSERT with ON CONFLICT support for the configured database
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+# Duplicate rows must be removed before a unique index can be added to a
+# database created by an earlier version. Participation counters are merged
+# into the row that is kept; for the others the earliest row wins.
+UNIQUE_INDEX_KEYS = {
+    'ix_enrollment_class_student': (Enrollment, ('class_id', 'student_id')),
+    'ix_attendance_class_date_student': (Attendance, ('class_id', 'date', 'student_id')),
+    'ix_participation_class_date_student': (Participation, ('class_id', 'date', 'student_id')),
+    'ix_poll_response_poll_student': (PollResponse, ('poll_id', 'student_id')),
+}
+
+def remove_duplicate_rows(model, key_columns):
+    columns = [getattr(model, name) for name in key_columns]
+    duplicates = db.session.query(*columns, func.min(model.id)).group_by(*columns).having(
+        func.count(model.id) > 1
+    ).all()
+    for row in duplicates:
+        keep_id = row[-1]
+        rows = model.query.filter(*(column == value for column, value in zip(columns, row))).all()
+        kept = next(r for r in rows if r.id == keep_id)
+        for extra in rows:
+            if extra.id == keep_id:
+                continue
+            if model is Participation:
+                for column in INTERACTION_COLUMNS.values():
+                    setattr(kept, column, (getattr(kept, column) or 0) + (getattr(extra, column) or 0))
+            db.session.delete(extra)
+    db.session.commit()
+
+def migrate_database():
+    # Add columns and indexes declared on the models to tables created before
+    # they existed. Only columns with a server default can be added.
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in columns or column.server_default is None:
+                continue
+            with db.engine.begin() as connection:
+                connection.exec_driver_sql(
+                    f'ALTER TABLE {db.engine.dialect.identifier_preparer.format_table(table)} '
+                    f'ADD COLUMN {CreateColumn(column).compile(dialect=db.engine.dialect)}'
+                )
+        
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if index.name in UNIQUE_INDEX_KEYS:
+                remove_duplicate_rows(*UNIQUE_INDEX_KEYS[index.name])
+            index.create(db.engine)
+
+# Class shards
+# With CLASSROOM_SHARD_DIR set, the rows written while a class runs
+# (attendance, participation, the interaction log and poll answers) go to a
+# SQLite file of the class's own in that directory, so running classes do not
+# queue behind one write lock. The main database keeps everything else and
+# serves as the catalog. The class's file is attached to the connection as
+# schema "shard" when a transaction begins. The catalog has no tables of the
+# same names, so unqualified queries, joins with students and polls included,
+# reach it unchanged. The class is taken from the route's class_id; code that
+# gets a class from a request body, a buffer or a job picks it with
+# class_shard(). Polls stay in the catalog so their ids remain unique.
+SHARDED_TABLES = (Attendance.__table__, Participation.__table__, InteractionEvent.__table__, PollResponse.__table__)
+
+known_shards = set()
+known_shards_lock = threading.Lock()
+
+def shard_path(class_id):
+    return os.path.join(app.instance_path, app.config['SHARD_DIR'], f'class_{int(class_id)}.db')
+
+def ensure_class_shard(class_id, connection):
+    # Files are only created for classes in the catalog; returns whether the
+    # class has one
+    with known_shards_lock:
+        if class_id in known_shards:
+            return True
+        if connection.execute(select(Class.id).where(Class.id == class_id)).first() is None:
+            return False
+        os.makedirs(os.path.dirname(shard_path(class_id)), exist_ok=True)
+        engine = create_engine(f'sqlite:///{shard_path(class_id)}', poolclass=NullPool)
+        try:
+            db.metadata.create_all(engine, tables=SHARDED_TABLES)
+        finally:
+            engine.dispose()
+        known_shards.add(class_id)
+        return True
+
+def drop_class_shard(class_id):
+    with known_shards_lock:
+        known_shards.discard(class_id)
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(shard_path(class_id) + suffix)
+            except FileNotFoundError:
+                pass
+
+def use_class_shard(class_id):
+    # A transaction stays on the shard it began with, so work begun on
+    # another one is committed first
+    class_id = int(class_id) if class_id is not None else None
+    if not app.config['SHARD_DIR'] or g.get('shard_class_id') == class_id:
+        return
+    if db.session().in_transaction():
+        db.session.commit()
+    g.shard_class_id = class_id
+
+@contextmanager
+def class_shard(class_id):
+    if not app.config['SHARD_DIR']:
+        yield
+        return
+    previous = g.get('shard_class_id')
+    use_class_shard(class_id)
+    try:
+        yield
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        use_class_shard(previous)
+
+def shard_groups(rows, class_id_of):
+    # [(class_id, rows)] by shard, or one group for the whole batch without shards
+    if not app.config['SHARD_DIR']:
+        return [(None, rows)]
+    groups = {}
+    for row in rows:
+        groups.setdefault(class_id_of(row), []).append(row)
+    return list(groups.items())
+
+def attach_class_shard(session, transaction, connection):
+    class_id = g.get('shard_class_id') if has_app_context() else None
+    if class_id is None:
+        return
+    if not ensure_class_shard(class_id, connection):
+        return
+    connection.exec_driver_sql('ATTACH DATABASE ? AS shard', (shard_path(class_id),))
+    connection.info['shard'] = class_id
+    # journal_mode was stored in the file when it was created
+    synchronous = DB_PROFILES[app.config['DB_PROFILE']]['pragmas'].get('synchronous')
+    if synchronous:
+        connection.exec_driver_sql(f'PRAGMA shard.synchronous = {synchronous}')
+
+def detach_class_shard(dbapi_connection, connection_record):
+    if dbapi_connection is not None and connection_record.info.pop('shard', None) is not None:
+        dbapi_connection.execute('DETACH DATABASE shard')
+
+def open_route_shard():
+    if request.view_args and 'class_id' in request.view_args:
+        use_class_shard(request.view_args['class_id'])
+
+if app.config['SHARD_DIR']:
+    event.listen(db.session, 'after_begin', attach_class_shard)
+    event.listen(Pool, 'checkin', detach_class_shard)
+    app.before_request(open_route_shard)
+
+# Live session state
+# Counters for each running class are kept in memory so the faculty dashboard
+# can be refreshed without querying the database. The state is built once when
+# the class starts and is updated by the handlers that record student activity.
+# Changes are collected and pushed to the class room as one live_stats_delta
+# event per LIVE_STATS_PUSH_INTERVAL.
+class LivePoll:
+    def __init__(self, poll_id, question, options, is_anonymous, correct_answer=None):
+        self.poll_id = poll_id
+        self.question = question
+        self.options = options
+        self.is_anonymous = is_anonymous
+        self.correct_answer = correct_answer
+        self.option_counts = [0] * len(options)
+        self.total_responses = 0
+        self.responders = set()
+        self.claimed = set()  # answered on this worker, not yet counted back from the queue
+        self.changed_options = set()
+
+    def to_dict(self):
+        return {
+            'poll_id': self.poll_id,
+            'question': self.question,
+            'options': self.options,
+            'option_counts': dict(enumerate(self.option_counts)),
+            'total_responses': self.total_responses,
+            'is_anonymous': self.is_anonymous
+        }
+
+    def to_message(self):
+        # Everything another worker needs to take over the poll
+        return {
+            **self.to_dict(),
+            'correct_answer': self.correct_answer,
+            'responders': list(self.responders)
+        }
+
+    @classmethod
+    def from_message(cls, data):
+        poll = cls(data['poll_id'], data['question'], data['options'], data['is_anonymous'], data['correct_answer'])
+        for option, count in data['option_counts'].items():
+            poll.option_counts[int(option)] = count
+        poll.total_responses = data['total_responses']
+        poll.responders.update(data['responders'])
+        return poll
+
+class LiveClassState:
+    def __init__(self, class_id):
+        self.class_id = class_id
+        self.lock = threading.Lock()
+        self.name = None
+        self.class_code = None
+        self.settings = None
+        self.total_students = 0
+        self.present_students = 0
+        self.total_hand_raises = 0
+        self.total_thumbs_up = 0
+        self.total_thumbs_down = 0
+        self.poll = None
+        self.changed = set()
+        self.poll_replaced = False
+        self.poll_dirty = False
+
+    def record_join(self, new_enrollment, new_attendance):
+        with self.lock:
+            if new_enrollment:
+                self.total_students += 1
+                self.changed.add('total_students')
+            if new_attendance:
+                self.present_students += 1
+                self.changed.add('present_students')
+
+    def record_enrollments(self, count):
+        with self.lock:
+            self.total_students += count
+            self.changed.add('total_students')
+
+    def record_interaction(self, interaction_type, count=1):
+        with self.lock:
+            if interaction_type == 'hand_raise':
+                self.total_hand_raises += count
+                self.changed.add('total_hand_raises')
+            elif interaction_type == 'thumbs_up':
+                self.total_thumbs_up += count
+                self.changed.add('total_thumbs_up')
+            elif interaction_type == 'thumbs_down':
+                self.total_thumbs_down += count
+                self.changed.add('total_thumbs_down')
+
+    def set_settings(self, settings):
+        with self.lock:
+            self.settings = settings
+
+    def class_info(self):
+        # What a nameplate needs to join the class
+        with self.lock:
+            return {
+                'id': self.class_id,
+                'name': self.name,
+                'class_code': self.class_code,
+                'settings': self.settings
+            }
+
+    def poll_for(self, student_id):
+        # The running poll as a nameplate shows it, or None
+        with self.lock:
+            poll = self.poll
+            if not poll:
+                return None
+            return {
+                'poll_id': poll.poll_id,
+                'question': poll.question,
+                'options': poll.options,
+                'is_anonymous': poll.is_anonymous,
+                'answered': student_id in poll.responders or student_id in poll.claimed
+            }
+
+    def set_poll(self, poll):
+        with self.lock:
+            self.poll = poll
+            self.poll_replaced = True
+
+    def clear_poll(self, poll_id):
+        with self.lock:
+            if self.poll and self.poll.poll_id == poll_id:
+                self.poll = None
+                self.poll_replaced = True
+
+    def claim_poll_response(self, poll_id, student_id):
+        # Check and reserve the student's answer in one step, before it is
+        # buffered and published, so two answers racing on this worker cannot
+        # both get through. False when the poll is not running or the student
+        # has answered.
+        with self.lock:
+            poll = self.poll
+            if not poll or poll.poll_id != poll_id or student_id in poll.responders or student_id in poll.claimed:
+                return False
+            poll.claimed.add(student_id)
+            return True
+
+    def record_poll_response(self, poll_id, student_id, answer):
+        with self.lock:
+            poll = self.poll
+            if not poll or poll.poll_id != poll_id or student_id in poll.responders:
+                return
+            poll.responders.add(student_id)
+            poll.claimed.discard(student_id)
+            if isinstance(answer, int) and 0 <= answer < len(poll.option_counts):
+                poll.option_counts[answer] += 1
+                poll.changed_options.add(answer)
+            poll.total_responses += 1
+            self.poll_dirty = True
+
+    def take_delta(self):
+        # Current values of everything that changed since the last call, or
+        # None when nothing did.
+        with self.lock:
+            if not self.changed and not self.poll_replaced and not self.poll_dirty:
+                return None
+            delta = {'class_id': self.class_id}
+            for field in self.changed:
+                delta[field] = getattr(self, field)
+            poll = self.poll
+            if self.poll_replaced:
+                delta['poll_stats'] = poll.to_dict() if poll else None
+            elif self.poll_dirty and poll:
+                delta['poll_counts'] = {
+                    'poll_id': poll.poll_id,
+                    'option_counts': {i: poll.option_counts[i] for i in poll.changed_options},
+                    'total_responses': poll.total_responses
+                }
+            self.changed.clear()
+            self.poll_replaced = False
+            self.poll_dirty = False
+            if poll:
+                poll.changed_options.clear()
+            return delta
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'total_students': self.total_students,
+                'present_students': self.present_students,
+                'total_hand_raises': self.total_hand_raises,
+                'total_thumbs_up': self.total_thumbs_up,
+                'total_thumbs_down': self.total_thumbs_down,
+                'poll_stats': self.poll.to_dict() if self.poll else None
+            }
+
+    def to_message(self):
+        with self.lock:
+            return {
+                'name': self.name,
+                'class_code': self.class_code,
+                'settings': self.settings,
+                'total_students': self.total_students,
+                'present_students': self.present_students,
+                'total_hand_raises': self.total_hand_raises,
+                'total_thumbs_up': self.total_thumbs_up,
+                'total_thumbs_down': self.total_thumbs_down,
+                'poll': self.poll.to_message() if self.poll else None
+            }
+
+    @classmethod
+    def from_message(cls, class_id, message):
+        state = cls(class_id)
+        for field, value in message.items():
+            if field == 'poll':
+                state.poll = LivePoll.from_message(value) if value else None
+            else:
+                setattr(state, field, value)
+        return state
+
+live_classes = {}
+live_classes_lock = threading.Lock()
+
+# Background tasks are started lazily, once per process, the first time they
+# are needed.
+background_tasks = set()
+background_tasks_lock = threading.Lock()
+
+def ensure_background_task(target):
+    with background_tasks_lock:
+        if target.__name__ in background_tasks:
+            return
+        background_tasks.add(target.__name__)
+    socketio.start_background_task(target)
+
+def push_live_stats_deltas():
+    while True:
+        socketio.sleep(app.config['LIVE_STATS_PUSH_INTERVAL'])
+        for state in list(live_classes.values()):
+            delta = state.take_delta()
+            if delta:
+                # Every worker holds the same state and serves its own sockets
+                socketio.emit('live_stats_delta', delta, room=instructor_room(state.class_id), ignore_queue=True)
+
+def load_live_poll(poll):
+    # Buffered answers must be in the database before they are counted
+    poll_response_buffer.flush()
+    
+    live_poll = LivePoll(poll.id, poll.question, json.loads(poll.options), poll.is_anonymous, poll.correct_answer)
+    with class_shard(poll.class_id):
+        responses = db.session.query(PollResponse.student_id, PollResponse.answer).filter(
+            PollResponse.poll_id == poll.id
+        ).all()
+    for student_id, answer in responses:
+        if answer is not None and 0 <= answer < len(live_poll.option_counts):
+            live_poll.option_counts[answer] += 1
+        live_poll.total_responses += 1
+        live_poll.responders.add(student_id)
+    return live_poll
+
+def load_live_state(class_id):
+    # Buffered taps must be in the database before it is counted
+    interaction_buffer.flush(class_id)
+    
+    state = LiveClassState(class_id)
+    today = datetime.utcnow().date()
+    
+    class_obj = db.session.get(Class, class_id)
+    state.name, state.class_code = class_obj.name, class_obj.class_code
+    state.settings = settings_dict(ClassSettings.query.filter_by(class_id=class_id).first())
+    
+    state.total_students = Enrollment.query.filter_by(class_id=class_id).count()
+    
+    start, end = day_bounds(today)
+    with class_shard(class_id):
+        state.present_students = Attendance.query.filter_by(
+            class_id=class_id,
+            date=today,
+            present=True
+        ).count()
+        interactions = db.session.query(InteractionEvent.kind, func.count(InteractionEvent.id)).filter(
+            InteractionEvent.class_id == class_id,
+            InteractionEvent.created_at >= start,
+            InteractionEvent.created_at < end
+        ).group_by(InteractionEvent.kind).all()
+    for kind, count in interactions:
+        state.record_interaction(INTERACTION_TYPES[kind], count)
+    state.changed.clear()
+    
+    active_poll = Poll.query.filter_by(class_id=class_id, is_active=True).first()
+    if active_poll:
+        state.poll = load_live_poll(active_poll)
+    return state
+
+def register_live_state(state):
+    with live_classes_lock:
+        live_classes[state.class_id] = state
+    ensure_background_task(push_live_stats_deltas)
+    return state
+
+def start_live_state(class_id):
+    state = load_live_state(class_id)
+    update_live_state('start', class_id, state=state.to_message())
+
+def stop_live_state(class_id):
+    update_live_state('stop', class_id)
+
+def get_live_state(class_id):
+    try:
+        class_id = int(class_id)
+    except (TypeError, ValueError):
+        return None
+    return live_classes.get(class_id)
+
+def update_live_state(op, class_id, **args):
+    # Change the live state of a class. In multi-worker mode the change is
+    # published through the message queue and applied by every worker,
+    # including this one.
+    try:
+        class_id = int(class_id)
+    except (TypeError, ValueError):
+        return
+    publish_live_update({'op': op, 'class_id': class_id, **args})
+
+def publish_live_update(message):
+    if isinstance(socketio.server.manager, LiveStateManagerMixin):
+        socketio.server.manager.emit(LIVE_UPDATE_EVENT, message, namespace='/', room=LIVE_UPDATE_ROOM)
+    else:
+        apply_live_update(message)
+
+def apply_live_update(message):
+    op = message['op']
+    if op == 'invalidate_students':
+        student_cache.invalidate(message['student_ids'])
+        return
+    
+    class_id = message['class_id']
+    if op == 'start':
+        register_live_state(LiveClassState.from_message(class_id, message['state']))
+        return
+    if op == 'stop':
+        with live_classes_lock:
+            live_classes.pop(class_id, None)
+        return
+    
+    state = live_classes.get(class_id)
+    if not state:
+        return
+    if op == 'join':
+        state.record_join(message['new_enrollment'], message['new_attendance'])
+    elif op == 'enrolled':
+        state.record_enrollments(message['count'])
+    elif op == 'settings':
+        state.set_settings(message['settings'])
+    elif op == 'interaction':
+        state.record_interaction(message['type'], message.get('count', 1))
+    elif op == 'poll_started':
+        state.set_poll(LivePoll.from_message(message['poll']))
+    elif op == 'poll_stopped':
+        state.clear_poll(message['poll_id'])
+    elif op == 'poll_response':
+        state.record_poll_response(message['poll_id'], message['student_id'], message['answer'])
+
+def find_live_poll(poll_id):
+    # The live poll with this id, if its class is running on this worker
+    for state in list(live_classes.values()):
+        poll = state.poll
+        if poll and poll.poll_id == poll_id:
+            return state.class_id, poll
+    return None, None
+
+# Interaction write-behind
+# Taps are acknowledged immediately and appended to an in-memory list. The
+# list is written to the InteractionEvent log in one bulk insert every
+# INTERACTION_FLUSH_INTERVAL, when a class stops and when the process exits.
+# A tap sent with an idempotency key is recorded once however many times the
+# nameplate retried it; see RecentEventKeys.
+# The daily counters in Participation are derived from the log by
+# rollup_interactions when the class stops.
+INTERACTION_COLUMNS = {
+    'hand_raise': 'hand_raises',
+    'thumbs_up': 'thumbs_up',
+    'thumbs_down': 'thumbs_down'
+}
+
+class InteractionBuffer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = []
+
+    def add(self, class_id, student_id, interaction_type, created_at=None):
+        with self.lock:
+            self.pending.append({
+                'class_id': class_id,
+                'student_id': student_id,
+                'kind': INTERACTION_TYPES.index(interaction_type),
+                'created_at': created_at or datetime.utcnow()
+            })
+
+    def take(self, class_id=None):
+        with self.lock:
+            if class_id is None:
+                batch, self.pending = self.pending, []
+            else:
+                batch = [row for row in self.pending if row['class_id'] == class_id]
+                self.pending = [row for row in self.pending if row['class_id'] != class_id]
+        return batch
+
+    def restore(self, batch):
+        with self.lock:
+            self.pending[:0] = batch
+
+    def flush(self, class_id=None):
+        batch = self.take(class_id)
+        if not batch:
+            return 0
+        groups = shard_groups(batch, lambda row: row['class_id'])
+        for number, (shard_class_id, rows) in enumerate(groups):
+            try:
+                with class_shard(shard_class_id):
+                    db.session.execute(InteractionEvent.__table__.insert(), rows)
+                    db.session.commit()
+            except Exception:
+                db.session.rollback()
+                self.restore(rows_of_known_classes([row for _, rows in groups[number:] for row in rows]))
+                raise
+        return len(batch)
+
+def rows_of_known_classes(rows):
+    # Taps of a class that no longer exists can never be written, and would
+    # fail every later flush with them; they are dropped
+    try:
+        known = {class_id for (class_id,) in db.session.query(Class.id).filter(
+            Class.id.in_({row['class_id'] for row in rows})
+        )}
+    except Exception:
+        db.session.rollback()
+        return rows
+    kept = [row for row in rows if row['class_id'] in known]
+    if len(kept) < len(rows):
+        app.logger.warning(f'Dropped {len(rows) - len(kept)} buffered taps of unknown classes')
+    return kept
+
+def rollup_interactions(class_id):
+    # Re-count the class's recent days from the log into Participation. Whole
+    # days are counted, so running it again gives the same counters.
+    start, _ = day_bounds(datetime.utcnow().date() - timedelta(days=app.config['INTERACTION_ROLLUP_DAYS']))
+    day = time_bucket(InteractionEvent.created_at, 'day')
+    counters = {}
+    for student_id, date, kind, count in db.session.query(
+        InteractionEvent.student_id, day, InteractionEvent.kind, func.count(InteractionEvent.id)
+    ).filter(
+        InteractionEvent.class_id == class_id,
+        InteractionEvent.created_at >= start
+    ).group_by(InteractionEvent.student_id, day, InteractionEvent.kind):
+        row = counters.get((student_id, date))
+        if row is None:
+            row = counters[(student_id, date)] = {
+                'class_id': class_id,
+                'student_id': student_id,
+                'date': datetime.strptime(date, '%Y-%m-%d').date(),
+                **dict.fromkeys(INTERACTION_COLUMNS.values(), 0)
+            }
+        row[INTERACTION_COLUMNS[INTERACTION_TYPES[kind]]] = count
+    if not counters:
+        return 0
+    
+    stmt = dialect_insert(Participation.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['class_id', 'date', 'student_id'],
+        set_={column: stmt.excluded[column] for column in INTERACTION_COLUMNS.values()}
+    )
+    db.session.execute(stmt, list(counters.values()))
+    db.session.commit()
+    return len(counters)
+
+interaction_buffer = InteractionBuffer()
+
+# A tap whose ack was lost is sent again with the same idempotency key, over
+# HTTP or later through /api/student/sync. The latest keys of each student are
+# reserved here before a tap changes anything, so the retry is dropped before
+# it reaches the buffer, the live counters or the dashboard. Only keys that go
+# through sync are also written to SyncedEvent.
+class RecentEventKeys:
+    def __init__(self, per_student):
+        self.lock = threading.Lock()
+        self.per_student = per_student
+        self.keys = {}
+
+    def claim(self, student_id, key):
+        # False when the key was seen before
+        with self.lock:
+            keys = self.keys.setdefault(student_id, OrderedDict())
+            if key in keys:
+                return False
+            keys[key] = None
+            if len(keys) > self.per_student:
+                keys.popitem(last=False)
+            return True
+
+recent_event_keys = RecentEventKeys(app.config['RECENT_KEYS_PER_STUDENT'])
+
+def flush_interactions_periodically():
+    while True:
+        socketio.sleep(app.config['INTERACTION_FLUSH_INTERVAL'])
+        with app.app_context():
+            try:
+                interaction_buffer.flush()
+            except Exception as e:
+                app.logger.error(f'Failed to flush interactions: {e}')
+
+# Poll answer write-behind
+# Answers to the live poll of a running class are checked against the poll's
+# responders and counted in memory, so the burst of answers that follows a
+# question costs no database round trips. The rows are inserted in one bulk
+# statement every POLL_RESPONSE_FLUSH_INTERVAL, and before a poll stops, its
+# class stops or is deleted, and the process exits.
+class PollResponseBuffer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = []
+
+    def add(self, poll_id, student_id, answer, is_correct):
+        with self.lock:
+            self.pending.append({
+                'poll_id': poll_id,
+                'student_id': student_id,
+                'answer': answer,
+                'is_correct': is_correct,
+                'timestamp': datetime.utcnow()
+            })
+
+    def take(self):
+        with self.lock:
+            batch, self.pending = self.pending, []
+        return batch
+
+    def restore(self, batch):
+        with self.lock:
+            self.pending[:0] = batch
+
+    def flush(self):
+        batch = self.take()
+        if not batch:
+            return 0
+        try:
+            poll_classes = {}
+            if app.config['SHARD_DIR']:
+                poll_classes = dict(db.session.query(Poll.id, Poll.class_id).filter(
+                    Poll.id.in_({row['poll_id'] for row in batch})
+                ))
+            groups = shard_groups(batch, lambda row: poll_classes.get(row['poll_id']))
+        except Exception:
+            db.session.rollback()
+            self.restore(batch)
+            raise
+        for number, (shard_class_id, rows) in enumerate(groups):
+            if shard_class_id is None and app.config['SHARD_DIR']:
+                continue  # the poll was deleted
+            try:
+                with class_shard(shard_class_id):
+                    db.session.execute(
+                        dialect_insert(PollResponse.__table__).on_conflict_do_nothing(index_elements=['poll_id', 'student_id']),
+                        rows
+                    )
+                    db.session.commit()
+            except Exception:
+                db.session.rollback()
+                self.restore(writable_answers([row for _, rows in groups[number:] for row in rows]))
+                raise
+        return len(batch)
+
+def valid_answer(answer, option_count):
+    return isinstance(answer, int) and not isinstance(answer, bool) and 0 <= answer < option_count
+
+def writable_answers(rows):
+    # Answers to a poll that no longer exists, or that are not one of its
+    # options, can never be written and would fail every later flush; they
+    # are dropped
+    try:
+        option_counts = {poll_id: len(json.loads(options)) for poll_id, options in db.session.query(Poll.id, Poll.options).filter(
+            Poll.id.in_({row['poll_id'] for row in rows})
+        )}
+    except Exception:
+        db.session.rollback()
+        return rows
+    kept = [row for row in rows if valid_answer(row['answer'], option_counts.get(row['poll_id'], 0))]
+    if len(kept) < len(rows):
+        app.logger.warning(f'Dropped {len(rows) - len(kept)} buffered poll answers that cannot be written')
+    return kept
+
+poll_response_buffer = PollResponseBuffer()
+
+def flush_poll_responses_periodically():
+    while True:
+        socketio.sleep(app.config['POLL_RESPONSE_FLUSH_INTERVAL'])
+        with app.app_context():
+            try:
+                poll_response_buffer.flush()
+            except Exception as e:
+                app.logger.error(f'Failed to flush poll responses: {e}')
+
+@atexit.register
+def flush_buffers_on_shutdown():
+    with app.app_context():
+        interaction_buffer.flush()
+        poll_response_buffer.flush()
+
+# Student lookup cache
+# A card tap or student number login is answered from an LRU cache of student
+# records with the ids of their classes, so the taps that follow a class start
+# do not queue up behind its join and attendance writes. start_class warms the
+# cache with the class roster. Records are dropped on every worker when the
+# student registers, is imported or enrolled, and the whole cache is dropped
+# when a class is deleted.
+class StudentCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.students = OrderedDict()
+        self.by_rfid = {}
+        self.by_number = {}
+
+    def get(self, rfid_card_id=None, student_number=None):
+        with self.lock:
+            if rfid_card_id:
+                student_id = self.by_rfid.get(rfid_card_id)
+            else:
+                student_id = self.by_number.get(student_number)
+            if student_id is None:
+                return None
+            self.students.move_to_end(student_id)
+            return self.students[student_id]
+
+    def put(self, record):
+        with self.lock:
+            self.remove(record['id'])
+            self.students[record['id']] = record
+            self.by_number[record['student_number']] = record['id']
+            if record['rfid_card_id']:
+                self.by_rfid[record['rfid_card_id']] = record['id']
+            while len(self.students) > self.max_size:
+                self.remove(next(iter(self.students)))
+
+    def remove(self, student_id):
+        # Callers hold the lock
+        record = self.students.pop(student_id, None)
+        if record:
+            self.by_number.pop(record['student_number'], None)
+            if record['rfid_card_id']:
+                self.by_rfid.pop(record['rfid_card_id'], None)
+
+    def invalidate(self, student_ids=None):
+        with self.lock:
+            if student_ids is None:
+                self.students.clear()
+                self.by_rfid.clear()
+                self.by_number.clear()
+                return
+            for student_id in student_ids:
+                self.remove(student_id)
+
+student_cache = StudentCache(app.config['STUDENT_CACHE_SIZE'])
+
+def invalidate_students(student_ids=None):
+    # None drops every cached student
+    if student_ids is not None:
+        student_ids = list(student_ids)
+    publish_live_update({'op': 'invalidate_students', 'student_ids': student_ids})
+
+def load_student_records(condition):
+    records = {}
+    for student_id, student_number, first_name, last_name, rfid_card_id, class_id in db.session.query(
+        Student.id, Student.student_number, Student.first_name, Student.last_name,
+        Student.rfid_card_id, Enrollment.class_id
+    ).outerjoin(Enrollment, Enrollment.student_id == Student.id).filter(condition):
+        record = records.setdefault(student_id, {
+            'id': student_id,
+            'student_number': student_number,
+            'first_name': first_name,
+            'last_name': last_name,
+            'rfid_card_id': rfid_card_id,
+            'class_ids': []
+        })
+        if class_id is not None:
+            record['class_ids'].append(class_id)
+    return list(records.values())
+
+def warm_student_cache(class_id):
+    roster = select(Enrollment.student_id).where(Enrollment.class_id == class_id)
+    for record in load_student_records(Student.id.in_(roster)):
+        student_cache.put(record)
+
+def lookup_student(rfid_card_id=None, student_number=None):
+    record = student_cache.get(rfid_card_id, student_number)
+    if record is None:
+        if rfid_card_id:
+            records = load_student_records(Student.rfid_card_id == rfid_card_id)
+        else:
+            records = load_student_records(Student.student_number == student_number)
+        if not records:
+            return None
+        record = records[0]
+        student_cache.put(record)
+    return record
+
+def active_classes_for(record):
+    states = [live_classes.get(class_id) for class_id in record['class_ids']]
+    if record['class_ids'] and not any(states):
+        # Classes started before this process came up are loaded once
+        for class_obj in Class.query.filter(Class.id.in_(record['class_ids']), Class.is_active == True):
+            register_live_state(load_live_state(class_obj.id))
+        states = [live_classes.get(class_id) for class_id in record['class_ids']]
+    return [state.class_info() for state in states if state]
+
 @login_manager.user_loader
 def load_user(user_id):
     return Professor.query.get(int(user_id))
@@ -113,6 +1486,34 @@ def index():
         return redirect(url_for('dashboard'))
     return redirect(url_for('login'))
 
+@app.route('/metrics')
+def metrics():
+    if not app.config['METRICS_ENABLED']:
+        abort(404)
+    
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    
+    rooms = socketio.server.manager.rooms.get('/', {})
+    lines += ['# HELP classroom_connected_sockets Sockets connected to this worker.',
+              '# TYPE classroom_connected_sockets gauge',
+              f'classroom_connected_sockets {len(rooms.get(None, ()))}']
+    lines += ['# HELP classroom_room_sockets Sockets in each class room on this worker.',
+              '# TYPE classroom_room_sockets gauge']
+    class_rooms = sorted((room, len(members)) for room, members in list(rooms.items())
+                         if isinstance(room, str) and room.startswith('class_'))
+    for room, size in class_rooms:
+        lines.append(f"classroom_room_sockets{metric_labels(('room',), (room,))} {size}")
+    lines += ['# HELP classroom_live_classes Running classes with live state on this worker.',
+              '# TYPE classroom_live_classes gauge',
+              f'classroom_live_classes {len(live_classes)}',
+              '# HELP classroom_pending_writes Buffered rows waiting for the next flush.',
+              '# TYPE classroom_pending_writes gauge',
+              f'classroom_pending_writes{{buffer="interactions"}} {len(interaction_buffer.pending)}',
+              f'classroom_pending_writes{{buffer="poll_responses"}} {len(poll_response_buffer.pending)}']
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -176,7 +1577,7 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    classes = Class.query.filter_by(professor_id=current_user.id).all()
+    classes = Class.query.filter_by(professor_id=current_user.id, is_deleted=False).all()
     return render_template('dashboard.html', classes=classes)
 
 @app.route('/preferences')
@@ -188,7 +1589,7 @@ def preferences():
 @login_required
 def classroom(class_id):
     class_obj = Class.query.get_or_404(class_id)
-    if class_obj.professor_id != current_user.id:
+    if class_obj.professor_id != current_user.id or class_obj.is_deleted:
         return redirect(url_for('dashboard'))
     
     students = db.session.query(Student).join(Enrollment).filter(
@@ -209,11 +1610,16 @@ def start_class(class_id):
     class_obj = Class.query.get_or_404(class_id)
     if class_obj.professor_id != current_user.id:
         return jsonify({'success': False, 'error': 'Unauthorized'})
+    if class_obj.is_deleted:
+        return jsonify({'success': False, 'error': 'Class is being deleted'})
     
     class_obj.is_active = True
     db.session.commit()
     
-    socketio.emit('class_started', {'class_id': class_id, 'class_code': class_obj.class_code}, room=f'class_{class_id}')
+    start_live_state(class_id)
+    warm_student_cache(class_id)
+    
+    socketio.emit('class_started', {'class_id': class_id, 'class_code': class_obj.class_code}, room=class_rooms(class_id))
     
     return jsonify({'success': True, 'redirect': url_for('faculty_dashboard', class_id=class_id)})
 
@@ -223,66 +1629,581 @@ def stop_class(class_id):
     class_obj = Class.query.get_or_404(class_id)
     if class_obj.professor_id != current_user.id:
         return jsonify({'success': False, 'error': 'Unauthorized'})
+    if class_obj.is_deleted:
+        return jsonify({'success': False, 'error': 'Class is being deleted'})
     
     class_obj.is_active = False
+    SyncedEvent.query.filter(
+        SyncedEvent.received_at < datetime.utcnow() - app.config['SYNC_KEY_RETENTION']
+    ).delete(synchronize_session=False)
     db.session.commit()
     
-    # Update gradebook with participation data
-    update_gradebook(class_id)
+    stop_live_state(class_id)
+    # Buffered activity is written here, since the job may run on another worker
+    interaction_buffer.flush(class_id)
+    poll_response_buffer.flush()
     
-    socketio.emit('class_stopped', {'class_id': class_id}, room=f'class_{class_id}')
+    # Participation rollup and gradebook update run in the background
+    job = enqueue_job('end_session', class_id, date=datetime.utcnow().date().isoformat())
     
-    return jsonify({'success': True})
+    socketio.emit('class_stopped', {'class_id': class_id}, room=class_rooms(class_id))
+    
+    return jsonify({'success': True, 'job_id': job.id})
 
-def update_gradebook(class_id):
-    today = datetime.utcnow().date()
-    students = db.session.query(Student).join(Enrollment).filter(
+def update_gradebook(class_id, date=None):
+    today = date or datetime.utcnow().date()
+    student_ids = [student_id for (student_id,) in db.session.query(Enrollment.student_id).filter(
         Enrollment.class_id == class_id
-    ).all()
+    )]
+    
+    # Every enrolled student gets a participation record for the session
+    if student_ids:
+        db.session.execute(
+            dialect_insert(Participation.__table__).on_conflict_do_nothing(
+                index_elements=['class_id', 'date', 'student_id']
+            ),
+            [{'class_id': class_id, 'student_id': student_id, 'date': today} for student_id in student_ids]
+        )
     
-    for student in students:
-        participation = Participation.query.filter_by(
-            class_id=class_id,
-            student_id=student.id,
-            date=today
-        ).first()
-        
-        if not participation:
-            participation = Participation(
-                class_id=class_id,
-                student_id=student.id,
-                date=today
+    rollup_session(class_id, today, student_ids)
+    db.session.commit()
+
+def rollup_session(class_id, date, student_ids):
+    summaries = {summary.student_id: summary for summary in GradeSummary.query.filter_by(class_id=class_id)}
+    if not summaries and student_ids:
+        # First rollup of a class recorded before summaries existed; its
+        # whole history is counted, the session being rolled up included
+        rebuild_grade_summaries(class_id)
+        return
+    
+    windows = {}
+    for student_id in student_ids:
+        summary = summaries.get(student_id)
+        if not summary:
+            summary = new_grade_summary(class_id, student_id)
+            db.session.add(summary)
+        windows.setdefault(summary.session_window(date), []).append(summary)
+    
+    # Students share a window unless they enrolled since the last session
+    for after, window_summaries in windows.items():
+        attendance, participation, polls = gradebook_aggregates(class_id, after=after, through=date)
+        for summary in window_summaries:
+            student_id = summary.student_id
+            summary.apply_session(date, after, session_totals(
+                attendance.get(student_id), participation.get(student_id), polls.get(student_id)
+            ))
+
+def session_totals(attendance, participation, polls):
+    totals = dict.fromkeys(GRADE_SUMMARY_FIELDS, 0)
+    if attendance:
+        totals['attendance_count'] = attendance.present
+        totals['attendance_records'] = attendance.records
+    if participation:
+        totals['participation_days'] = participation.days
+        totals['peer_grade_total'] = participation.peer_grade or 0.0
+        totals['instructor_grade_total'] = participation.instructor_grade or 0.0
+        totals['hand_raises'] = participation.hand_raises or 0
+        totals['thumbs_up'] = participation.thumbs_up or 0
+        totals['thumbs_down'] = participation.thumbs_down or 0
+    if polls:
+        totals['poll_correct'] = polls.correct
+        totals['poll_total'] = polls.total
+    return totals
+
+def rebuild_grade_summaries(class_id):
+    # Recompute a class's summaries from its full history. Used for classes
+    # whose sessions were recorded before the rollup existed.
+    today = datetime.utcnow().date()
+    student_ids = [student_id for (student_id,) in db.session.query(Enrollment.student_id).filter(
+        Enrollment.class_id == class_id
+    )]
+    GradeSummary.query.filter_by(class_id=class_id).delete()
+    
+    sessions_held = db.session.query(func.count(func.distinct(Participation.date))).filter(
+        Participation.class_id == class_id,
+        Participation.date < today
+    ).scalar()
+    yesterday = today - timedelta(days=1)
+    attendance, participation, polls = gradebook_aggregates(class_id, through=yesterday)
+    for student_id in student_ids:
+        summary = new_grade_summary(class_id, student_id)
+        summary.sessions_held = sessions_held
+        for field, value in session_totals(
+            attendance.get(student_id), participation.get(student_id), polls.get(student_id)
+        ).items():
+            setattr(summary, field, value)
+        # Counted through yesterday; the next rollup starts from today
+        summary.last_session = json.dumps({'date': yesterday.isoformat(), 'after': None, **dict.fromkeys(GRADE_SUMMARY_FIELDS, 0)})
+        db.session.add(summary)
+    db.session.flush()
+    
+    # A session already held today is rolled up on its own so that the next
+    # stop_class replaces it rather than counting it twice
+    held_today = db.session.query(Participation.id).filter(
+        Participation.class_id == class_id,
+        Participation.date == today
+    ).first()
+    if held_today and student_ids:
+        rollup_session(class_id, today, student_ids)
+    db.session.commit()
+
+# Background jobs
+# End-of-session work runs after the request that asks for it has returned.
+# Jobs are rows in the job table, so work that was queued, or cut short by a
+# restart, is picked up again. Each process runs jobs one at a time on a
+# background task and claims a job with a conditional UPDATE, so two workers
+# never run the same one. Progress and completion are pushed to the class's
+# instructor room.
+def enqueue_job(kind, class_id=None, **params):
+    job = Job(
+        kind=kind,
+        class_id=class_id,
+        professor_id=current_user.id if has_request_context() and current_user.is_authenticated else None,
+        params=json.dumps(params),
+        status='queued',
+        progress=0.0
+    )
+    db.session.add(job)
+    db.session.commit()
+    ensure_background_task(run_jobs)
+    emit_job_update(job)
+    return job
+
+def emit_job_update(job):
+    if job.class_id is None:
+        return
+    event_name = 'job_finished' if job.status in ('done', 'failed') else 'job_progress'
+    socketio.emit(event_name, job.to_dict(), room=instructor_room(job.class_id))
+
+def report_job_progress(job, progress):
+    # Also the job's heartbeat; see JOB_STALE_AFTER
+    job.progress = progress
+    job.updated_at = datetime.utcnow()
+    db.session.commit()
+    emit_job_update(job)
+
+def claim_next_job():
+    for job_id, in db.session.query(Job.id).filter(Job.status == 'queued').order_by(Job.id).limit(5).all():
+        now = datetime.utcnow()
+        result = db.session.execute(
+            update(Job).where(Job.id == job_id, Job.status == 'queued').values(
+                status='running', started_at=now, updated_at=now
             )
-            db.session.add(participation)
-        
-        # Calculate poll grade
-        poll_responses = PollResponse.query.join(Poll).filter(
-            Poll.class_id == class_id,
-            PollResponse.student_id == student.id,
-            Poll.created_at >= datetime.combine(today, datetime.min.time())
-        ).all()
-        
-        poll_grade = 0.0
-        if poll_responses:
-            correct_count = sum(1 for pr in poll_responses if pr.is_correct)
-            poll_grade = (correct_count / len(poll_responses)) * 100
-        
+        )
         db.session.commit()
+        if result.rowcount:
+            return db.session.get(Job, job_id)
+    return None
+
+def requeue_stale_jobs():
+    # Running jobs whose worker stopped reporting progress died with it
+    cutoff = datetime.utcnow() - app.config['JOB_STALE_AFTER']
+    Job.query.filter(Job.status == 'running', Job.updated_at < cutoff).update(
+        {'status': 'queued'}, synchronize_session=False
+    )
+    db.session.commit()
+
+def run_job(job):
+    job_id = job.id
+    try:
+        handler = JOB_HANDLERS.get(job.kind)
+        if not handler:
+            raise ValueError(f"Unknown job kind '{job.kind}'")
+        with class_shard(job.class_id):
+            handler(job, **json.loads(job.params or '{}'))
+        job.status = 'done'
+        job.progress = 1.0
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f'Job {job_id} ({job.kind}) failed: {e}')
+        job = db.session.get(Job, job_id)
+        job.status = 'failed'
+        job.error = str(e)
+    job.finished_at = job.updated_at = datetime.utcnow()
+    db.session.commit()
+    emit_job_update(job)
+
+def run_jobs():
+    last_requeue = 0
+    while True:
+        with app.app_context():
+            try:
+                if time.time() - last_requeue > app.config['JOB_STALE_AFTER'].total_seconds():
+                    requeue_stale_jobs()
+                    last_requeue = time.time()
+                job = claim_next_job()
+                while job:
+                    run_job(job)
+                    job = claim_next_job()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f'Job runner failed: {e}')
+        socketio.sleep(app.config['JOB_POLL_INTERVAL'])
+
+def start_job_runner():
+    # Called by every serving process, so jobs left over from before a
+    # restart run without waiting for a new one to be queued
+    ensure_background_task(run_jobs)
+
+def run_end_session_job(job, date):
+    if isinstance(socketio.server.manager, LiveStateManagerMixin):
+        # Other workers write the taps and answers they buffered before the
+        # stop on their own flush timers; wait those out before rolling up
+        settle = 2 * max(app.config['INTERACTION_FLUSH_INTERVAL'], app.config['POLL_RESPONSE_FLUSH_INTERVAL'])
+        remaining = settle - (datetime.utcnow() - job.created_at).total_seconds()
+        if remaining > 0:
+            socketio.sleep(remaining)
+    class_obj = db.session.get(Class, job.class_id)
+    if not class_obj or class_obj.is_deleted:
+        return
+    date = datetime.strptime(date, '%Y-%m-%d').date()
+    rollup_interactions(job.class_id)
+    report_job_progress(job, 0.5)
+    update_gradebook(job.class_id, date)
+
+def delete_in_chunks(job, table, condition, progress):
+    # One transaction per chunk, so the write lock is given up between chunks
+    # and live classes keep writing while a large class is removed
+    chunk_size = app.config['JOB_CHUNK_SIZE']
+    deleted = 0
+    while True:
+        chunk = select(table.c.id).where(condition).limit(chunk_size)
+        result = db.session.execute(table.delete().where(table.c.id.in_(chunk)))
+        db.session.commit()
+        deleted += result.rowcount
+        if result.rowcount < chunk_size:
+            return deleted
+        report_job_progress(job, progress)
+        socketio.sleep(0)
+
+def run_delete_class_job(job):
+    class_id = job.class_id
+    steps = [
+        (PollResponse.__table__, PollResponse.poll_id.in_(select(Poll.id).where(Poll.class_id == class_id))),
+        (Poll.__table__, Poll.class_id == class_id),
+        (InteractionEvent.__table__, InteractionEvent.class_id == class_id),
+        (Participation.__table__, Participation.class_id == class_id),
+        (Attendance.__table__, Attendance.class_id == class_id),
+        (GradeSummary.__table__, GradeSummary.class_id == class_id),
+        (Enrollment.__table__, Enrollment.class_id == class_id),
+        (ClassSettings.__table__, ClassSettings.class_id == class_id)
+    ]
+    if app.config['SHARD_DIR']:
+        # The class's shard file is removed whole
+        steps = [step for step in steps if step[0] not in SHARDED_TABLES]
+    for number, (table, condition) in enumerate(steps):
+        delete_in_chunks(job, table, condition, number / len(steps))
+        report_job_progress(job, (number + 1) / len(steps))
+    
+    delete_archived_class(class_id)
+    Class.query.filter_by(id=class_id, is_deleted=True).delete()
+    db.session.commit()
+    if app.config['SHARD_DIR']:
+        use_class_shard(None)
+        drop_class_shard(class_id)
+
+# Term archive
+# Sessions from past terms are moved out of the hot tables into a separate
+# database, classroom_archive.db unless CLASSROOM_ARCHIVE_URI says otherwise.
+# With class shards each class has an archive file next to its shard.
+# Archived rows keep their ids and columns. Grade summaries stay, so the
+# gradebook still counts archived sessions; exports only cover what is left.
+ARCHIVED_TABLES = (PollResponse.__table__, Poll.__table__, InteractionEvent.__table__,
+                   Participation.__table__, Attendance.__table__)
+
+archive_engines = {}
+archive_engines_lock = threading.Lock()
+
+def archive_url(class_id):
+    url = make_url(app.config['ARCHIVE_DATABASE_URI'])
+    if app.config['SHARD_DIR']:
+        # Row ids are only unique within a shard, so each class is archived
+        # to a file next to its shard
+        return make_url(f"sqlite:///{os.path.splitext(shard_path(class_id))[0]}.archive.db")
+    if url.get_backend_name() == 'sqlite' and url.database and url.database != ':memory:' and not os.path.isabs(url.database):
+        # Relative paths are kept next to the main database, as Flask-SQLAlchemy does
+        os.makedirs(app.instance_path, exist_ok=True)
+        url = url.set(database=os.path.join(app.instance_path, url.database))
+    return url
+
+def get_archive_engine(class_id):
+    url = archive_url(class_id)
+    with archive_engines_lock:
+        engine = archive_engines.get(str(url))
+        if engine is None:
+            engine = create_engine(url)
+            db.metadata.create_all(engine, tables=ARCHIVED_TABLES)
+            archive_engines[str(url)] = engine
+    return engine
+
+def delete_archived_class(class_id):
+    url = archive_url(class_id)
+    if url.get_backend_name() == 'sqlite' and url.database and not os.path.exists(url.database):
+        return  # nothing was archived
+    if app.config['SHARD_DIR']:
+        with archive_engines_lock:
+            engine = archive_engines.pop(str(url), None)
+        if engine:
+            engine.dispose()
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(url.database + suffix)
+            except FileNotFoundError:
+                pass
+        return
+    
+    polls = select(Poll.id).where(Poll.class_id == class_id)
+    with get_archive_engine(class_id).begin() as connection:
+        connection.execute(PollResponse.__table__.delete().where(PollResponse.poll_id.in_(polls)))
+        for table in (Poll.__table__, InteractionEvent.__table__, Participation.__table__, Attendance.__table__):
+            connection.execute(table.delete().where(table.c.class_id == class_id))
+
+def archive_in_chunks(job, class_id, table, condition, progress):
+    engine = get_archive_engine(class_id)
+    insert_for = postgresql.insert if engine.dialect.name == 'postgresql' else sqlite.insert
+    chunk_size = app.config['JOB_CHUNK_SIZE']
+    moved = 0
+    while True:
+        rows = [dict(row) for row in db.session.execute(
+            select(table).where(condition).order_by(table.c.id).limit(chunk_size)
+        ).mappings()]
+        if not rows:
+            return moved
+        # The archive is written first; a chunk copied again after a crash is skipped there
+        with engine.begin() as connection:
+            connection.execute(insert_for(table).on_conflict_do_nothing(), rows)
+        db.session.execute(table.delete().where(table.c.id.in_([row['id'] for row in rows])))
+        db.session.commit()
+        moved += len(rows)
+        report_job_progress(job, progress)
+        socketio.sleep(0)
+
+def run_archive_term_job(job, before):
+    # Everything the professor's classes recorded before the given date
+    before = datetime.strptime(before, '%Y-%m-%d').date()
+    start, _ = day_bounds(before)
+    class_ids = [class_id for (class_id,) in db.session.query(Class.id).filter(
+        Class.professor_id == job.professor_id,
+        Class.is_deleted == False
+    )]
+    total = len(class_ids) * len(ARCHIVED_TABLES)
+    done = 0
+    for class_id in class_ids:
+        polls = select(Poll.id).where(Poll.class_id == class_id, Poll.created_at < start, Poll.is_active == False)
+        steps = [
+            (PollResponse.__table__, PollResponse.poll_id.in_(polls)),
+            (Poll.__table__, Poll.id.in_(polls)),
+            (InteractionEvent.__table__, (InteractionEvent.class_id == class_id) & (InteractionEvent.created_at < start)),
+            (Participation.__table__, (Participation.class_id == class_id) & (Participation.date < before)),
+            (Attendance.__table__, (Attendance.class_id == class_id) & (Attendance.date < before))
+        ]
+        with class_shard(class_id):
+            if not GradeSummary.query.filter_by(class_id=class_id).first():
+                # The summaries are what keeps archived sessions in the gradebook
+                rebuild_grade_summaries(class_id)
+            for table, condition in steps:
+                archive_in_chunks(job, class_id, table, condition, done / total)
+                done += 1
+                report_job_progress(job, done / total)
+
+JOB_HANDLERS = {
+    'end_session': run_end_session_job,
+    'delete_class': run_delete_class_job,
+    'archive_term': run_archive_term_job
+}
+
+def can_view_job(job):
+    if job.professor_id is not None:
+        return job.professor_id == current_user.id
+    class_obj = db.session.get(Class, job.class_id) if job.class_id else None
+    return bool(class_obj and class_obj.professor_id == current_user.id)
+
+@app.route('/api/jobs/<int:job_id>')
+@login_required
+def get_job(job_id):
+    job = Job.query.get_or_404(job_id)
+    if not can_view_job(job):
+        return jsonify({'success': False, 'error': 'Unauthorized'})
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+@app.route('/api/class_jobs/<int:class_id>')
+@login_required
+def get_class_jobs(class_id):
+    # Unfinished jobs and the ten most recent ones
+    class_obj = Class.query.get_or_404(class_id)
+    if class_obj.professor_id != current_user.id:
+        return jsonify({'success': False, 'error': 'Unauthorized'})
+    
+    jobs = Job.query.filter_by(class_id=class_id).order_by(Job.id.desc()).limit(10).all()
+    unfinished = Job.query.filter(Job.class_id == class_id, Job.status.in_(('queued', 'running'))).all()
+    by_id = {job.id: job for job in unfinished + jobs}
+    return jsonify({'success': True, 'jobs': [by_id[job_id].to_dict() for job_id in sorted(by_id, reverse=True)]})
+
+@app.route('/api/archive_term', methods=['POST'])
+@login_required
+def archive_term():
+    # Move sessions before {"before": "YYYY-MM-DD"} of all the professor's classes to the archive
+    data = request.get_json() or {}
+    try:
+        before = datetime.strptime(data.get('before') or '', '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Date must be YYYY-MM-DD'})
+    
+    # The days rollup_interactions re-counts from the log stay in place
+    latest = datetime.utcnow().date() - timedelta(days=app.config['INTERACTION_ROLLUP_DAYS'])
+    if before > latest:
+        return jsonify({'success': False, 'error': f'Only sessions before {latest.isoformat()} can be archived'})
+    
+    job = enqueue_job('archive_term', before=before.isoformat())
+    return jsonify({'success': True, 'job_id': job.id})
 
 @app.route('/faculty_dashboard/<int:class_id>')
 @login_required
 def faculty_dashboard(class_id):
     class_obj = Class.query.get_or_404(class_id)
-    if class_obj.professor_id != current_user.id:
+    if class_obj.professor_id != current_user.id or class_obj.is_deleted:
         return redirect(url_for('dashboard'))
     
-    students = db.session.query(Student).join(Enrollment).filter(
+    # The page is patched in place from here on: socket events for changes,
+    # /api/live_snapshot after a reconnect
+    return render_template('faculty_dashboard.html', class_obj=class_obj,
+                           snapshot=live_snapshot(dashboard_live_state(class_obj)))
+
+@app.route('/api/live_snapshot/<int:class_id>')
+@login_required
+def get_live_snapshot(class_id):
+    class_obj = Class.query.get_or_404(class_id)
+    if class_obj.professor_id != current_user.id:
+        return jsonify({'success': False, 'error': 'Unauthorized'})
+    
+    return jsonify({'success': True, **live_snapshot(dashboard_live_state(class_obj))})
+
+def dashboard_live_state(class_obj):
+    state = get_live_state(class_obj.id)
+    if not state:
+        # The class was started before this process came up (or is not running);
+        # rebuild this worker's copy of its state once from the database.
+        state = load_live_state(class_obj.id)
+        if class_obj.is_active:
+            register_live_state(state)
+    return state
+
+def live_snapshot(state):
+    return {
+        'class_id': state.class_id,
+        'settings': state.class_info()['settings'],
+        'stats': state.snapshot()
+    }
+
+@app.route('/api/timeline/<int:class_id>')
+@login_required
+def get_timeline(class_id):
+    # Taps per minute of one day's session (?date=YYYY-MM-DD, default today)
+    class_obj = Class.query.get_or_404(class_id)
+    if class_obj.professor_id != current_user.id:
+        return jsonify({'success': False, 'error': 'Unauthorized'})
+    
+    try:
+        date = datetime.strptime(request.args['date'], '%Y-%m-%d').date() if 'date' in request.args else datetime.utcnow().date()
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Date must be YYYY-MM-DD'})
+    
+    interaction_buffer.flush(class_id)
+    start, end = day_bounds(date)
+    minute = time_bucket(InteractionEvent.created_at, 'minute')
+    buckets = {}
+    for bucket, kind, count in db.session.query(minute, InteractionEvent.kind, func.count(InteractionEvent.id)).filter(
+        InteractionEvent.class_id == class_id,
+        InteractionEvent.created_at >= start,
+        InteractionEvent.created_at < end
+    ).group_by(minute, InteractionEvent.kind).order_by(minute):
+        entry = buckets.get(bucket)
+        if entry is None:
+            entry = buckets[bucket] = {'minute': bucket, **dict.fromkeys(INTERACTION_TYPES, 0)}
+        entry[INTERACTION_TYPES[kind]] = count
+    
+    return jsonify({'success': True, 'class_id': class_id, 'date': date.isoformat(), 'buckets': list(buckets.values())})
+
+def gradebook_aggregates(class_id, after=None, through=None):
+    # Per-student totals for a class, computed with one grouped query per table.
+    # Limited to the session dates after and up to the given dates.
+    attendance_filters = [Attendance.class_id == class_id]
+    participation_filters = [Participation.class_id == class_id]
+    poll_filters = [Poll.class_id == class_id]
+    if after is not None:
+        attendance_filters.append(Attendance.date > after)
+        participation_filters.append(Participation.date > after)
+        poll_filters.append(Poll.created_at >= datetime.combine(after + timedelta(days=1), datetime.min.time()))
+    if through is not None:
+        attendance_filters.append(Attendance.date <= through)
+        participation_filters.append(Participation.date <= through)
+        poll_filters.append(Poll.created_at < datetime.combine(through + timedelta(days=1), datetime.min.time()))
+    
+    attendance = {row.student_id: row for row in db.session.query(
+        Attendance.student_id,
+        func.sum(case((Attendance.present == True, 1), else_=0)).label('present'),
+        func.count(Attendance.id).label('records')
+    ).filter(*attendance_filters).group_by(Attendance.student_id)}
+    
+    participation = {row.student_id: row for row in db.session.query(
+        Participation.student_id,
+        func.sum(Participation.peer_grade).label('peer_grade'),
+        func.sum(Participation.instructor_grade).label('instructor_grade'),
+        func.sum(Participation.hand_raises).label('hand_raises'),
+        func.sum(Participation.thumbs_up).label('thumbs_up'),
+        func.sum(Participation.thumbs_down).label('thumbs_down'),
+        func.count(Participation.id).label('days')
+    ).filter(*participation_filters).group_by(Participation.student_id)}
+    
+    polls = {row.student_id: row for row in db.session.query(
+        PollResponse.student_id,
+        func.sum(case((PollResponse.is_correct == True, 1), else_=0)).label('correct'),
+        func.count(PollResponse.id).label('total')
+    ).join(Poll, Poll.id == PollResponse.poll_id).filter(
+        *poll_filters
+    ).group_by(PollResponse.student_id)}
+    
+    return attendance, participation, polls
+
+def gradebook_query(class_id):
+    # Classes whose history predates the rollup are summarized once
+    if not GradeSummary.query.filter_by(class_id=class_id).first():
+        rebuild_grade_summaries(class_id)
+    return gradebook_select(class_id)
+
+def gradebook_select(class_id):
+    return select(
+        Student.id, Student.student_number, Student.first_name, Student.last_name, GradeSummary
+    ).join(Enrollment, Enrollment.student_id == Student.id).outerjoin(
+        GradeSummary,
+        (GradeSummary.class_id == Enrollment.class_id) & (GradeSummary.student_id == Student.id)
+    ).filter(
         Enrollment.class_id == class_id
-    ).all()
-    
-    active_poll = Poll.query.filter_by(class_id=class_id, is_active=True).first()
-    
-    return render_template('faculty_dashboard.html', class_obj=class_obj, students=students, active_poll=active_poll)
+    )
+
+def gradebook_entry(student_id, student_number, first_name, last_name, summary):
+    attendance_grade = 0
+    avg_peer_grade = 0
+    avg_instructor_grade = 0
+    poll_grade = 0
+    if summary:
+        if summary.attendance_records > 0:
+            attendance_grade = summary.attendance_count / summary.attendance_records * 100
+        if summary.participation_days > 0:
+            avg_peer_grade = summary.peer_grade_total / summary.participation_days
+            avg_instructor_grade = summary.instructor_grade_total / summary.participation_days
+        if summary.poll_total > 0:
+            poll_grade = (summary.poll_correct / summary.poll_total) * 100
+    
+    return {
+        'student_id': student_id,
+        'student_number': student_number,
+        'name': f"{first_name} {last_name}",
+        'attendance_grade': round(attendance_grade, 2),
+        'peer_participation': round(avg_peer_grade, 2),
+        'instructor_participation': round(avg_instructor_grade, 2),
+        'poll_grade': round(poll_grade, 2)
+    }
 
 @app.route('/api/gradebook/<int:class_id>')
 @login_required
@@ -290,58 +2211,266 @@ def get_gradebook(class_id):
     class_obj = Class.query.get_or_404(class_id)
     if class_obj.professor_id != current_user.id:
         return jsonify({'error': 'Unauthorized'}), 403
+    if class_obj.is_deleted:
+        abort(404)
     
-    students = db.session.query(Student).join(Enrollment).filter(
-        Enrollment.class_id == class_id
-    ).all()
-    
-    gradebook_data = []
-    for student in students:
-        attendances = Attendance.query.filter_by(
-            class_id=class_id,
-            student_id=student.id
-        ).all()
-        
-        participations = Participation.query.filter_by(
-            class_id=class_id,
-            student_id=student.id
-        ).all()
-        
-        poll_responses = PollResponse.query.join(Poll).filter(
-            Poll.class_id == class_id,
-            PollResponse.student_id == student.id
-        ).all()
-        
-        attendance_count = sum(1 for a in attendances if a.present)
-        total_classes = len(attendances)
-        attendance_grade = (attendance_count / total_classes * 100) if total_classes > 0 else 0
-        
-        avg_peer_grade = sum(p.peer_grade for p in participations) / len(participations) if participations else 0
-        avg_instructor_grade = sum(p.instructor_grade for p in participations) / len(participations) if participations else 0
-        
-        poll_grade = 0
-        if poll_responses:
-            correct_count = sum(1 for pr in poll_responses if pr.is_correct)
-            poll_grade = (correct_count / len(poll_responses)) * 100
-        
-        gradebook_data.append({
-            'student_id': student.id,
-            'student_number': student.student_number,
-            'name': f"{student.first_name} {student.last_name}",
-            'attendance_grade': round(attendance_grade, 2),
-            'peer_participation': round(avg_peer_grade, 2),
-            'instructor_participation': round(avg_instructor_grade, 2),
-            'poll_grade': round(poll_grade, 2)
-        })
+    gradebook_data = [gradebook_entry(*row) for row in db.session.execute(gradebook_query(class_id))]
     
     return jsonify(gradebook_data)
 
+# Exports
+# Gradebook, attendance, participation and poll results are streamed to the
+# browser as CSV or XLSX. Rows are read with yield_per so that even a
+# multi-year class never has to fit in memory, and the XLSX workbook is
+# written as a streamed zip of plain XML.
+EXPORT_BATCH_SIZE = 1000
+EXPORT_KINDS = ('gradebook', 'attendance', 'participation', 'polls')
+XML_ILLEGAL_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')  # a spreadsheet reads these as the start of a formula
+
+def export_gradebook(class_id):
+    header = ['Student Number', 'Name', 'Attendance %', 'Peer Participation', 'Instructor Participation', 'Poll Grade %']
+    if GradeSummary.query.filter_by(class_id=class_id).first():
+        rows = db.session.execute(
+            gradebook_select(class_id).order_by(Student.student_number).execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+    else:
+        # Not summarized yet; the totals are computed from the rows without
+        # storing them, which is left to the next gradebook view or rollup
+        rows = unsaved_gradebook_rows(class_id)
+    
+    def generate():
+        for row in rows:
+            entry = gradebook_entry(*row)
+            yield (entry['student_number'], entry['name'], entry['attendance_grade'],
+                   entry['peer_participation'], entry['instructor_participation'], entry['poll_grade'])
+    return header, generate()
+
+def unsaved_gradebook_rows(class_id):
+    # Counts what rebuild_grade_summaries would: today only once a session
+    # held today has been rolled up
+    today = datetime.utcnow().date()
+    held_today = db.session.query(Participation.id).filter(
+        Participation.class_id == class_id,
+        Participation.date == today
+    ).first()
+    attendance, participation, polls = gradebook_aggregates(
+        class_id, through=today if held_today else today - timedelta(days=1)
+    )
+    students = db.session.query(
+        Student.id, Student.student_number, Student.first_name, Student.last_name
+    ).join(Enrollment, Enrollment.student_id == Student.id).filter(
+        Enrollment.class_id == class_id
+    ).order_by(Student.student_number).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    for student_id, student_number, first_name, last_name in students:
+        summary = new_grade_summary(class_id, student_id)
+        for field, value in session_totals(
+            attendance.get(student_id), participation.get(student_id), polls.get(student_id)
+        ).items():
+            setattr(summary, field, value)
+        yield student_id, student_number, first_name, last_name, summary
+
+def export_attendance(class_id):
+    header = ['Date', 'Student Number', 'Name', 'Present']
+    rows = db.session.query(
+        Attendance.date, Student.student_number, Student.first_name, Student.last_name, Attendance.present
+    ).join(Student, Student.id == Attendance.student_id).filter(
+        Attendance.class_id == class_id
+    ).order_by(Attendance.date, Student.student_number).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    
+    def generate():
+        for date, student_number, first_name, last_name, present in rows:
+            yield date.isoformat(), student_number, f"{first_name} {last_name}", bool(present)
+    return header, generate()
+
+def export_participation(class_id):
+    header = ['Date', 'Student Number', 'Name', 'Hand Raises', 'Thumbs Up', 'Thumbs Down', 'Peer Grade', 'Instructor Grade']
+    rows = db.session.query(
+        Participation.date, Student.student_number, Student.first_name, Student.last_name,
+        Participation.hand_raises, Participation.thumbs_up, Participation.thumbs_down,
+        Participation.peer_grade, Participation.instructor_grade
+    ).join(Student, Student.id == Participation.student_id).filter(
+        Participation.class_id == class_id
+    ).order_by(Participation.date, Student.student_number).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    
+    def generate():
+        for date, student_number, first_name, last_name, hand_raises, thumbs_up, thumbs_down, peer, instructor in rows:
+            yield (date.isoformat(), student_number, f"{first_name} {last_name}", hand_raises or 0,
+                   thumbs_up or 0, thumbs_down or 0, peer or 0.0, instructor or 0.0)
+    return header, generate()
+
+def export_polls(class_id):
+    header = ['Date', 'Question', 'Student Number', 'Name', 'Answer', 'Correct', 'Answered At']
+    rows = db.session.query(
+        Poll.id, Poll.created_at, Poll.question, Poll.options, Poll.is_anonymous,
+        Student.student_number, Student.first_name, Student.last_name,
+        PollResponse.answer, PollResponse.is_correct, PollResponse.timestamp
+    ).join(PollResponse, PollResponse.poll_id == Poll.id).join(
+        Student, Student.id == PollResponse.student_id
+    ).filter(
+        Poll.class_id == class_id
+    ).order_by(Poll.created_at, Poll.id, Student.student_number).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    
+    def generate():
+        poll_id, options = None, []
+        for row in rows:
+            if row.id != poll_id:
+                poll_id, options = row.id, json.loads(row.options)
+            answer = options[row.answer] if row.answer is not None and 0 <= row.answer < len(options) else row.answer
+            # Anonymous polls are exported without the student
+            student_number, name = ('', 'Anonymous') if row.is_anonymous else (
+                row.student_number, f"{row.first_name} {row.last_name}")
+            yield (row.created_at.date().isoformat(), row.question, student_number, name, answer,
+                   bool(row.is_correct), row.timestamp.isoformat(sep=' ', timespec='seconds') if row.timestamp else '')
+    return header, generate()
+
+EXPORTERS = {
+    'gradebook': export_gradebook,
+    'attendance': export_attendance,
+    'participation': export_participation,
+    'polls': export_polls
+}
+
+def csv_cell(value):
+    # Names come from student self-registration; text that would be run as a
+    # formula is quoted the way spreadsheets expect
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def stream_csv(header, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow([csv_cell(value) for value in row])
+        if buffer.tell() >= 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+class ZipStreamSink:
+    """Write-only file for zipfile: it has no seek, so zipfile writes each
+    entry with a trailing data descriptor and the output can be streamed."""
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    )
+}
+
+def xlsx_cell(value):
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c><v>{value}</v></c>'
+    text = xml_escape(XML_ILLEGAL_CHARS.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+def stream_xlsx(sheet_name, header, rows):
+    sink = ZipStreamSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as workbook:
+        for name, content in XLSX_PARTS.items():
+            workbook.writestr(name, content)
+        workbook.writestr('xl/workbook.xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{xml_escape(sheet_name)}" sheetId="1" r:id="rId1"/></sheets>'
+            '</workbook>'
+        ))
+        yield sink.drain()
+        
+        with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(('<row>' + ''.join(xlsx_cell(value) for value in header) + '</row>').encode())
+            for count, row in enumerate(rows, 1):
+                sheet.write(('<row>' + ''.join(xlsx_cell(value) for value in row) + '</row>').encode())
+                if count % EXPORT_BATCH_SIZE == 0:
+                    yield sink.drain()
+            sheet.write(b'</sheetData></worksheet>')
+    yield sink.drain()
+
+@app.route('/api/export/<int:class_id>/<kind>.<any(csv, xlsx):file_format>')
+@login_required
+def export_class_data(class_id, kind, file_format):
+    class_obj = Class.query.get_or_404(class_id)
+    if class_obj.professor_id != current_user.id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    if class_obj.is_deleted:
+        abort(404)
+    if kind not in EXPORTERS:
+        abort(404)
+    
+    # Answers to a running poll are only buffered; participation counters
+    # are rolled up by the end_session job and exported as they stand
+    poll_response_buffer.flush()
+    
+    header, rows = EXPORTERS[kind](class_id)
+    filename = secure_filename(f'{class_obj.class_code}-{kind}.{file_format}') or f'export.{file_format}'
+    if file_format == 'csv':
+        body, mimetype = stream_csv(header, rows), 'text/csv'
+    else:
+        body = stream_xlsx(kind.capitalize(), header, rows)
+        mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
 @app.route('/api/update_settings/<int:class_id>', methods=['POST'])
 @login_required
 def update_settings(class_id):
     class_obj = Class.query.get_or_404(class_id)
     if class_obj.professor_id != current_user.id:
         return jsonify({'success': False, 'error': 'Unauthorized'})
+    if class_obj.is_deleted:
+        return jsonify({'success': False, 'error': 'Class is being deleted'})
     
     settings = ClassSettings.query.filter_by(class_id=class_id).first()
     if not settings:
@@ -354,10 +2483,9 @@ def update_settings(class_id):
     
     db.session.commit()
     
-    socketio.emit('settings_updated', {
-        'show_first_name_only': settings.show_first_name_only,
-        'quiet_mode': settings.quiet_mode
-    }, room=f'class_{class_id}')
+    update_live_state('settings', class_id, settings=settings_dict(settings))
+    
+    socketio.emit('settings_updated', settings_dict(settings), room=students_room(class_id))
     
     return jsonify({'success': True})
 
@@ -367,6 +2495,8 @@ def create_poll(class_id):
     class_obj = Class.query.get_or_404(class_id)
     if class_obj.professor_id != current_user.id:
         return jsonify({'success': False, 'error': 'Unauthorized'})
+    if class_obj.is_deleted:
+        return jsonify({'success': False, 'error': 'Class is being deleted'})
     
     data = request.get_json()
     question = data.get('question')
@@ -388,12 +2518,15 @@ def create_poll(class_id):
     db.session.add(poll)
     db.session.commit()
     
+    update_live_state('poll_started', class_id,
+                      poll=LivePoll(poll.id, question, options, is_anonymous, correct_answer).to_message())
+    
     socketio.emit('poll_started', {
         'poll_id': poll.id,
         'question': question,
         'options': options,
         'is_anonymous': is_anonymous
-    }, room=f'class_{class_id}')
+    }, room=class_rooms(class_id))
     
     return jsonify({'success': True, 'poll_id': poll.id})
 
@@ -405,10 +2538,13 @@ def stop_poll(poll_id):
     if class_obj.professor_id != current_user.id:
         return jsonify({'success': False, 'error': 'Unauthorized'})
     
+    poll_response_buffer.flush()
     poll.is_active = False
     db.session.commit()
     
-    socketio.emit('poll_stopped', {'poll_id': poll_id}, room=f'class_{poll.class_id}')
+    update_live_state('poll_stopped', poll.class_id, poll_id=poll_id)
+    
+    socketio.emit('poll_stopped', {'poll_id': poll_id}, room=class_rooms(poll.class_id))
     
     return jsonify({'success': True})
 
@@ -443,32 +2579,20 @@ def delete_class(class_id):
         return jsonify({'success': False, 'error': 'Unauthorized'})
     
     try:
-        # Delete all related records
-        # First, delete poll responses for polls in this class
-        polls = Poll.query.filter_by(class_id=class_id).all()
-        for poll in polls:
-            PollResponse.query.filter_by(poll_id=poll.id).delete()
-        
-        # Delete polls
-        Poll.query.filter_by(class_id=class_id).delete()
-        
-        # Delete participations
-        Participation.query.filter_by(class_id=class_id).delete()
-        
-        # Delete attendances
-        Attendance.query.filter_by(class_id=class_id).delete()
-        
-        # Delete enrollments
-        Enrollment.query.filter_by(class_id=class_id).delete()
+        # The class disappears at once; its rows are deleted in chunks by a
+        # background job so live classes are not blocked meanwhile
+        class_obj.is_deleted = True
+        class_obj.is_active = False
+        db.session.commit()
         
-        # Delete class settings
-        ClassSettings.query.filter_by(class_id=class_id).delete()
+        stop_live_state(class_id)
+        poll_response_buffer.flush()
+        interaction_buffer.take(class_id)
+        invalidate_students()
         
-        # Finally, delete the class
-        db.session.delete(class_obj)
-        db.session.commit()
+        job = enqueue_job('delete_class', class_id)
         
-        return jsonify({'success': True})
+        return jsonify({'success': True, 'job_id': job.id})
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)})
@@ -483,6 +2607,8 @@ def add_student_to_class():
     class_obj = Class.query.get_or_404(class_id)
     if class_obj.professor_id != current_user.id:
         return jsonify({'success': False, 'error': 'Unauthorized'})
+    if class_obj.is_deleted:
+        return jsonify({'success': False, 'error': 'Class is being deleted'})
     
     enrollment = Enrollment.query.filter_by(
         class_id=class_id,
@@ -495,9 +2621,180 @@ def add_student_to_class():
     enrollment = Enrollment(class_id=class_id, student_id=student_id)
     db.session.add(enrollment)
     db.session.commit()
+    invalidate_students([student_id])
     
     return jsonify({'success': True})
 
+# Roster import
+# A roster is a list of students keyed on student_number, as JSON or as an
+# uploaded CSV file. Students are created or updated and bound to their RFID
+# cards, and enrolled in the class, with a handful of bulk statements in one
+# transaction. Rows that cannot be imported as given are reported back.
+ROSTER_FIELDS = ('student_number', 'first_name', 'last_name', 'rfid_card_id')
+ROSTER_COLUMN_ALIASES = {
+    'number': 'student_number',
+    'student_id': 'student_number',
+    'first': 'first_name',
+    'last': 'last_name',
+    'rfid': 'rfid_card_id',
+    'card_id': 'rfid_card_id',
+    'rfid_card': 'rfid_card_id'
+}
+ROSTER_QUERY_CHUNK = 500  # keeps IN (...) lists under SQLite's parameter limit
+
+def read_roster_csv(file):
+    data = file.read()
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        text = data.decode('latin-1')
+    reader = csv.DictReader(io.StringIO(text))
+    columns = {}
+    for column in reader.fieldnames or []:
+        key = re.sub(r'[^a-z0-9]+', '_', column.strip().lower()).strip('_')
+        columns[column] = ROSTER_COLUMN_ALIASES.get(key, key)
+    return [{columns[column]: value for column, value in row.items() if column in columns} for row in reader]
+
+def clean_roster_row(row):
+    cleaned = {}
+    for field in ROSTER_FIELDS:
+        value = row.get(field) if isinstance(row, dict) else None
+        value = str(value).strip() if value is not None else ''
+        cleaned[field] = value or None
+    return cleaned
+
+def chunked(values, size=ROSTER_QUERY_CHUNK):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def import_roster(class_id, roster):
+    problems = []
+    rows = {}
+    cards = {}
+    for number, raw in enumerate(roster, 1):
+        row = clean_roster_row(raw)
+        student_number = row['student_number']
+        if not student_number:
+            problems.append({'row': number, 'student_number': None, 'error': 'Student number required'})
+            continue
+        if student_number in rows:
+            problems.append({'row': number, 'student_number': student_number, 'error': 'Duplicate student number in roster'})
+            continue
+        card = row['rfid_card_id']
+        if card and card in cards:
+            problems.append({'row': number, 'student_number': student_number,
+                             'error': f'RFID card also listed for {cards[card]}; card not bound', 'imported': True})
+            row['rfid_card_id'] = None
+        elif card:
+            cards[card] = student_number
+        rows[student_number] = (number, row)
+    
+    existing = {}
+    for numbers in chunked(rows):
+        for student_number, first_name, last_name in db.session.query(
+            Student.student_number, Student.first_name, Student.last_name
+        ).filter(Student.student_number.in_(numbers)):
+            existing[student_number] = (first_name, last_name)
+    card_owners = {}
+    for chunk in chunked(cards):
+        for card, student_number in db.session.query(Student.rfid_card_id, Student.student_number).filter(
+            Student.rfid_card_id.in_(chunk)
+        ):
+            card_owners[card] = student_number
+    
+    for student_number, (number, row) in list(rows.items()):
+        if student_number in existing:
+            # Names left blank keep the stored ones
+            first_name, last_name = existing[student_number]
+            row['first_name'] = row['first_name'] or first_name
+            row['last_name'] = row['last_name'] or last_name
+        elif not (row['first_name'] and row['last_name']):
+            problems.append({'row': number, 'student_number': student_number, 'error': 'First and last name required for a new student'})
+            del rows[student_number]
+            continue
+        owner = card_owners.get(row['rfid_card_id'])
+        if owner and owner != student_number:
+            problems.append({'row': number, 'student_number': student_number,
+                             'error': f'RFID card already assigned to {owner}; card not bound', 'imported': True})
+            row['rfid_card_id'] = None
+    
+    if rows:
+        # A blank card keeps the stored one
+        table = Student.__table__
+        stmt = dialect_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['student_number'],
+            set_={
+                'first_name': stmt.excluded.first_name,
+                'last_name': stmt.excluded.last_name,
+                'rfid_card_id': func.coalesce(stmt.excluded.rfid_card_id, table.c.rfid_card_id)
+            }
+        )
+        db.session.execute(stmt, [row for number, row in rows.values()])
+    
+    student_ids = {}
+    for numbers in chunked(rows):
+        for student_id, student_number in db.session.query(Student.id, Student.student_number).filter(
+            Student.student_number.in_(numbers)
+        ):
+            student_ids[student_number] = student_id
+    enrolled = {student_id for (student_id,) in db.session.query(Enrollment.student_id).filter(
+        Enrollment.class_id == class_id
+    )}
+    new_enrollments = [{'class_id': class_id, 'student_id': student_id}
+                       for student_id in student_ids.values() if student_id not in enrolled]
+    if new_enrollments:
+        db.session.execute(
+            dialect_insert(Enrollment.__table__).on_conflict_do_nothing(index_elements=['class_id', 'student_id']),
+            new_enrollments
+        )
+    db.session.commit()
+    
+    problems.sort(key=lambda problem: problem['row'])
+    for problem in problems:
+        problem.setdefault('imported', False)
+    return {
+        'success': True,
+        'created': sum(1 for student_number in rows if student_number not in existing),
+        'updated': sum(1 for student_number in rows if student_number in existing),
+        'enrolled': len(new_enrollments),
+        'already_enrolled': len(student_ids) - len(new_enrollments),
+        'conflicts': problems,
+        'student_ids': list(student_ids.values())
+    }
+
+@app.route('/api/import_roster/<int:class_id>', methods=['POST'])
+@login_required
+def import_roster_route(class_id):
+    class_obj = Class.query.get_or_404(class_id)
+    if class_obj.professor_id != current_user.id:
+        return jsonify({'success': False, 'error': 'Unauthorized'})
+    if class_obj.is_deleted:
+        return jsonify({'success': False, 'error': 'Class is being deleted'})
+    
+    if 'file' in request.files:
+        try:
+            roster = read_roster_csv(request.files['file'])
+        except csv.Error as e:
+            return jsonify({'success': False, 'error': f'Could not read CSV: {e}'})
+    else:
+        data = request.get_json(silent=True)
+        roster = data.get('students') if isinstance(data, dict) else data
+    if not isinstance(roster, list):
+        return jsonify({'success': False, 'error': 'Roster required: a CSV file or a JSON list of students'})
+    
+    try:
+        result = import_roster(class_id, roster)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+    
+    invalidate_students(result.pop('student_ids'))
+    if result['enrolled']:
+        update_live_state('enrolled', class_id, count=result['enrolled'])
+    return jsonify(result)
+
 # Student routes
 @app.route('/student')
 def student_interface():
@@ -509,23 +2806,22 @@ def student_login():
     rfid_card_id = data.get('rfid_card_id')
     student_number = data.get('student_number')
     
-    if rfid_card_id:
-        student = Student.query.filter_by(rfid_card_id=rfid_card_id).first()
-    elif student_number:
-        student = Student.query.filter_by(student_number=student_number).first()
-    else:
+    if not rfid_card_id and not student_number:
         return jsonify({'success': False, 'error': 'No identification provided'})
     
+    student = lookup_student(rfid_card_id, student_number)
     if student:
-        session['student_id'] = student.id
+        session['student_id'] = student['id']
         return jsonify({
             'success': True,
             'student': {
-                'id': student.id,
-                'student_number': student.student_number,
-                'first_name': student.first_name,
-                'last_name': student.last_name
-            }
+                'id': student['id'],
+                'student_number': student['student_number'],
+                'first_name': student['first_name'],
+                'last_name': student['last_name']
+            },
+            'socket_token': make_socket_token(student['id']),
+            'active_classes': active_classes_for(student)
         })
     
     return jsonify({'success': False, 'error': 'Student not found'})
@@ -549,6 +2845,7 @@ def student_register():
     )
     db.session.add(student)
     db.session.commit()
+    invalidate_students([student.id])
     
     session['student_id'] = student.id
     
@@ -559,7 +2856,8 @@ def student_register():
             'student_number': student.student_number,
             'first_name': student.first_name,
             'last_name': student.last_name
-        }
+        },
+        'socket_token': make_socket_token(student.id)
     })
 
 @app.route('/api/student/classes')
@@ -584,103 +2882,207 @@ def student_join_class():
     if not class_obj.is_active:
         return jsonify({'success': False, 'error': 'Class is not active'})
     
-    # Check if already enrolled
-    enrollment = Enrollment.query.filter_by(
-        class_id=class_id,
-        student_id=student_id
-    ).first()
+    join_class_session(student_id, class_id)
     
-    if not enrollment:
-        enrollment = Enrollment(class_id=class_id, student_id=student_id)
-        db.session.add(enrollment)
+    return jsonify({'success': True, 'class_id': class_id})
+
+def join_class_session(student_id, class_id):
+    # Enroll and mark attendance; rows that already exist are left alone
+    result = db.session.execute(
+        dialect_insert(Enrollment).values(class_id=class_id, student_id=student_id).on_conflict_do_nothing(
+            index_elements=['class_id', 'student_id']
+        )
+    )
+    new_enrollment = result.rowcount > 0
     
-    # Mark attendance
     today = datetime.utcnow().date()
-    attendance = Attendance.query.filter_by(
-        class_id=class_id,
-        student_id=student_id,
-        date=today
-    ).first()
-    
-    if not attendance:
-        attendance = Attendance(
-            class_id=class_id,
-            student_id=student_id,
-            date=today,
-            present=True
+    with class_shard(class_id):
+        result = db.session.execute(
+            dialect_insert(Attendance).values(
+                class_id=class_id,
+                student_id=student_id,
+                date=today,
+                present=True
+            ).on_conflict_do_nothing(index_elements=['class_id', 'date', 'student_id'])
         )
-        db.session.add(attendance)
+        new_attendance = result.rowcount > 0
+        
+        db.session.commit()
     
-    db.session.commit()
+    update_live_state('join', class_id, new_enrollment=new_enrollment, new_attendance=new_attendance)
+    if new_enrollment:
+        invalidate_students([student_id])
     
     socketio.emit('student_joined', {
         'student_id': student_id,
         'class_id': class_id
-    }, room=f'class_{class_id}')
+    }, room=instructor_room(class_id))
+
+@app.route('/api/student/tap', methods=['POST'])
+def student_tap():
+    # A card tap logs the student in, finds the running class they are
+    # enrolled in and marks them present, in one round trip. A nameplate in a
+    # building with several of the student's classes running can pass the
+    # class_code it is set up for.
+    data = request.get_json() or {}
+    rfid_card_id = data.get('rfid_card_id')
+    student_number = data.get('student_number')
+    if not rfid_card_id and not student_number:
+        return jsonify({'success': False, 'error': 'No identification provided'})
     
-    return jsonify({'success': True, 'class_id': class_id})
+    student = lookup_student(rfid_card_id, student_number)
+    if not student:
+        return jsonify({'success': False, 'error': 'Student not found'})
+    session['student_id'] = student['id']
+    
+    active_classes = active_classes_for(student)
+    class_code = data.get('class_code')
+    if class_code:
+        active_classes = [c for c in active_classes if c['class_code'] == class_code]
+    
+    joined = None
+    poll = None
+    if len(active_classes) == 1:
+        joined = active_classes[0]
+        join_class_session(student['id'], joined['id'])
+        state = get_live_state(joined['id'])
+        poll = state.poll_for(student['id']) if state else None
+    
+    return jsonify({
+        'success': True,
+        'student': {
+            'id': student['id'],
+            'student_number': student['student_number'],
+            'first_name': student['first_name'],
+            'last_name': student['last_name']
+        },
+        'socket_token': make_socket_token(student['id']),
+        'class': joined,
+        'active_classes': active_classes,
+        'poll': poll
+    })
 
-@app.route('/api/student/interaction', methods=['POST'])
-def student_interaction():
+# Interactions and poll answers arrive either over HTTP or over the
+# student's socket; both paths share these helpers.
+def record_interaction(student_id, data):
+    if not data:
+        return {'success': False, 'error': 'No data provided'}
+    
+    class_id = data.get('class_id')
+    interaction_type = data.get('type')  # 'hand_raise', 'thumbs_up', 'thumbs_down'
+    
+    if not class_id:
+        return {'success': False, 'error': 'Class ID required'}
+    
+    if not interaction_type:
+        return {'success': False, 'error': 'Interaction type required'}
+    
+    if interaction_type not in INTERACTION_COLUMNS:
+        return {'success': False, 'error': 'Invalid interaction type'}
+    
     try:
-        student_id = session.get('student_id')
-        if not student_id:
-            return jsonify({'success': False, 'error': 'Not logged in'})
-        
-        data = request.get_json()
-        if not data:
-            return jsonify({'success': False, 'error': 'No data provided'})
-        
-        class_id = data.get('class_id')
-        interaction_type = data.get('type')  # 'hand_raise', 'thumbs_up', 'thumbs_down'
-        
-        if not class_id:
-            return jsonify({'success': False, 'error': 'Class ID required'})
+        class_id = int(class_id)
+    except (TypeError, ValueError):
+        return {'success': False, 'error': 'Invalid class ID'}
+    
+    # Optional; a tap retried with the same key is written once
+    event_key = data.get('key')
+    if event_key is not None and (not isinstance(event_key, str) or not event_key or len(event_key) > 64):
+        return {'success': False, 'error': 'Invalid idempotency key'}
+    
+    if not get_live_state(class_id):
+        class_obj = db.session.get(Class, class_id)
+        if not class_obj or not class_obj.is_active:
+            return {'success': False, 'error': 'Class is not active'}
+    
+    # Appended to the event log by the next flush
+    if event_key is not None and not recent_event_keys.claim(student_id, event_key):
+        return {'success': True}  # already recorded
+    
+    interaction_buffer.add(class_id, student_id, interaction_type)
+    ensure_background_task(flush_interactions_periodically)
+    
+    update_live_state('interaction', class_id, type=interaction_type)
+    
+    socketio.emit('student_interaction', {
+        'student_id': student_id,
+        'class_id': class_id,
+        'type': interaction_type
+    }, room=instructor_room(class_id))
+    
+    return {'success': True}
+
+def record_poll_response(student_id, poll_id, answer):
+    # Returns None when the poll does not exist
+    try:
+        poll_id = int(poll_id)
+    except (TypeError, ValueError):
+        return None
+    
+    class_id, live_poll = find_live_poll(poll_id)
+    if live_poll:
+        state = get_live_state(class_id)
+        if not state:
+            return {'success': False, 'error': 'Poll is not active'}
+        if not valid_answer(answer, len(live_poll.options)):
+            return {'success': False, 'error': 'Invalid answer'}
+        if not state.claim_poll_response(poll_id, student_id):
+            return {'success': False, 'error': 'Already responded'}
+        correct_answer = live_poll.correct_answer
+        is_anonymous = live_poll.is_anonymous
+        is_correct = (correct_answer is not None and answer == correct_answer)
         
-        if not interaction_type:
-            return jsonify({'success': False, 'error': 'Interaction type required'})
+        # Written to PollResponse by the next flush
+        poll_response_buffer.add(poll_id, student_id, answer, is_correct)
+        ensure_background_task(flush_poll_responses_periodically)
+    else:
+        # Not the live poll of a running class; check against the database
+        poll = Poll.query.get(poll_id)
+        if not poll:
+            return None
+        if not poll.is_active:
+            return {'success': False, 'error': 'Poll is not active'}
+        if not valid_answer(answer, len(json.loads(poll.options))):
+            return {'success': False, 'error': 'Invalid answer'}
         
-        today = datetime.utcnow().date()
-        participation = Participation.query.filter_by(
-            class_id=class_id,
-            student_id=student_id,
-            date=today
-        ).first()
+        class_id = poll.class_id
+        is_anonymous = poll.is_anonymous
+        is_correct = (poll.correct_answer is not None and answer == poll.correct_answer)
         
-        if not participation:
-            participation = Participation(
-                class_id=class_id,
-                student_id=student_id,
-                date=today
+        with class_shard(class_id):
+            result = db.session.execute(
+                dialect_insert(PollResponse).values(
+                    poll_id=poll_id,
+                    student_id=student_id,
+                    answer=answer,
+                    is_correct=is_correct
+                ).on_conflict_do_nothing(index_elements=['poll_id', 'student_id'])
             )
-            db.session.add(participation)
-        
-        # Ensure fields are initialized to 0 if None
-        if participation.hand_raises is None:
-            participation.hand_raises = 0
-        if participation.thumbs_up is None:
-            participation.thumbs_up = 0
-        if participation.thumbs_down is None:
-            participation.thumbs_down = 0
-        
-        if interaction_type == 'hand_raise':
-            participation.hand_raises += 1
-        elif interaction_type == 'thumbs_up':
-            participation.thumbs_up += 1
-        elif interaction_type == 'thumbs_down':
-            participation.thumbs_down += 1
-        else:
-            return jsonify({'success': False, 'error': 'Invalid interaction type'})
-        
-        db.session.commit()
+            db.session.commit()
         
-        socketio.emit('student_interaction', {
-            'student_id': student_id,
-            'class_id': class_id,
-            'type': interaction_type
-        }, room=f'class_{class_id}')
+        if result.rowcount == 0:
+            return {'success': False, 'error': 'Already responded'}
+    
+    update_live_state('poll_response', class_id, poll_id=poll_id, student_id=student_id, answer=answer)
+    
+    socketio.emit('poll_response', {
+        'poll_id': poll_id,
+        'student_id': student_id,
+        'answer': answer,
+        'is_correct': is_correct,
+        'is_anonymous': is_anonymous
+    }, room=instructor_room(class_id))
+    
+    return {'success': True, 'is_correct': is_correct}
+
+@app.route('/api/student/interaction', methods=['POST'])
+def student_interaction():
+    try:
+        student_id = session.get('student_id')
+        if not student_id:
+            return jsonify({'success': False, 'error': 'Not logged in'})
         
-        return jsonify({'success': True})
+        return jsonify(record_interaction(student_id, request.get_json()))
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -692,116 +3094,330 @@ def student_poll_response():
         return jsonify({'success': False, 'error': 'Not logged in'})
     
     data = request.get_json()
-    poll_id = data.get('poll_id')
-    answer = data.get('answer')
-    
-    poll = Poll.query.get_or_404(poll_id)
-    if not poll.is_active:
-        return jsonify({'success': False, 'error': 'Poll is not active'})
-    
-    # Check if already responded
-    existing = PollResponse.query.filter_by(
-        poll_id=poll_id,
-        student_id=student_id
-    ).first()
-    
-    if existing:
-        return jsonify({'success': False, 'error': 'Already responded'})
-    
-    is_correct = (poll.correct_answer is not None and answer == poll.correct_answer)
+    result = record_poll_response(student_id, data.get('poll_id'), data.get('answer'))
+    if result is None:
+        abort(404)
     
-    response = PollResponse(
-        poll_id=poll_id,
-        student_id=student_id,
-        answer=answer,
-        is_correct=is_correct
+    return jsonify(result)
+
+# Offline sync
+# Nameplates queue taps and poll answers while their connection is down and
+# send the whole queue in one request when it comes back. Each event carries
+# an idempotency key and the time it happened on the device. Events whose key
+# was already applied are skipped, and the rest are written in one
+# transaction. Late taps update the live counters but are not broadcast as
+# taps.
+def parse_client_time(value, now):
+    # Milliseconds since the epoch; a missing or future time counts as now
+    try:
+        client_time = datetime.utcfromtimestamp(float(value) / 1000)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return now
+    return min(client_time, now)
+
+def parse_sync_event(event):
+    # (key, parsed event) or (key, error message)
+    if not isinstance(event, dict):
+        return None, 'Invalid event'
+    key = event.get('key')
+    if not isinstance(key, str) or not key or len(key) > 64:
+        return None, 'Idempotency key required'
+    kind = event.get('kind')
+    try:
+        if kind == 'interaction':
+            if event.get('type') not in INTERACTION_COLUMNS:
+                return key, 'Invalid interaction type'
+            return key, {'kind': kind, 'class_id': int(event['class_id']), 'type': event['type']}
+        if kind == 'poll_response':
+            if not isinstance(event.get('answer'), int):
+                return key, 'Invalid answer'
+            return key, {'kind': kind, 'poll_id': int(event['poll_id']), 'answer': event['answer']}
+    except (KeyError, TypeError, ValueError):
+        return key, 'Invalid class or poll ID'
+    return key, 'Unknown event kind'
+
+def sync_student_events(student_id, events):
+    now = datetime.utcnow()
+    # Older events would miss the Participation rollup, and their keys may
+    # already be purged
+    oldest = now - min(timedelta(days=app.config['INTERACTION_ROLLUP_DAYS']), app.config['SYNC_KEY_RETENTION'])
+    results = []
+    parsed = {}
+    for raw in events:
+        key, value = parse_sync_event(raw)
+        if isinstance(value, str):
+            results.append({'key': key, 'status': 'rejected', 'error': value})
+        elif key in parsed:
+            results.append({'key': key, 'status': 'duplicate'})
+        else:
+            value['time'] = parse_client_time(raw.get('client_time'), now)
+            if value['time'] < oldest:
+                results.append({'key': key, 'status': 'rejected', 'error': 'Event is too old to sync'})
+                continue
+            parsed[key] = value
+            results.append({'key': key, 'status': None})
+    
+    applied_before = set()
+    for keys in chunked(parsed):
+        applied_before.update(key for (key,) in db.session.query(SyncedEvent.event_key).filter(
+            SyncedEvent.student_id == student_id,
+            SyncedEvent.event_key.in_(keys)
+        ))
+    # Taps first sent live, whose ack was lost, were recorded under the same key
+    applied_before.update(
+        key for key, item in parsed.items()
+        if item['kind'] == 'interaction' and key not in applied_before and not recent_event_keys.claim(student_id, key)
     )
-    db.session.add(response)
+    pending = {key: item for key, item in parsed.items() if key not in applied_before}
+    
+    poll_ids = {item['poll_id'] for item in pending.values() if item['kind'] == 'poll_response'}
+    polls = {}
+    if poll_ids:
+        # Answers buffered by the live path must be in the table before the inserts below
+        poll_response_buffer.flush()
+        polls = {poll.id: poll for poll in Poll.query.filter(Poll.id.in_(poll_ids))}
+    
+    class_ids = {item['class_id'] for item in pending.values() if item['kind'] == 'interaction'}
+    known_classes = {}
+    if class_ids:
+        known_classes = dict(db.session.query(Class.id, Class.is_active).filter(
+            Class.id.in_(class_ids),
+            Class.is_deleted == False
+        ))
+    
+    errors = {}
+    interactions = []
+    answers = []
+    for key, item in pending.items():
+        if item['kind'] == 'interaction':
+            if item['class_id'] not in known_classes:
+                errors[key] = 'Class not found'
+                continue
+            interactions.append({
+                'class_id': item['class_id'],
+                'student_id': student_id,
+                'kind': INTERACTION_TYPES.index(item['type']),
+                'created_at': item['time']
+            })
+            continue
+        poll = polls.get(item['poll_id'])
+        if not poll:
+            errors[key] = 'Poll not found'
+        elif not poll.is_active:
+            errors[key] = 'Poll is not active'
+        else:
+            is_correct = poll.correct_answer is not None and item['answer'] == poll.correct_answer
+            with class_shard(poll.class_id):
+                result = db.session.execute(
+                    dialect_insert(PollResponse).values(
+                        poll_id=poll.id,
+                        student_id=student_id,
+                        answer=item['answer'],
+                        is_correct=is_correct,
+                        timestamp=item['time']
+                    ).on_conflict_do_nothing(index_elements=['poll_id', 'student_id'])
+                )
+            if result.rowcount == 0:
+                errors[key] = 'Already responded'
+            else:
+                answers.append((poll, item['answer'], is_correct))
+    
+    # With class shards each class's rows are committed as the next class
+    # is reached, and the keys below last
+    if interactions:
+        for shard_class_id, rows in shard_groups(interactions, lambda row: row['class_id']):
+            with class_shard(shard_class_id):
+                db.session.execute(InteractionEvent.__table__.insert(), rows)
+    applied = [key for key in pending if key not in errors]
+    if applied:
+        db.session.execute(SyncedEvent.__table__.insert(), [
+            {'student_id': student_id, 'event_key': key, 'received_at': now} for key in applied
+        ])
     db.session.commit()
     
-    socketio.emit('poll_response', {
-        'poll_id': poll_id,
-        'student_id': student_id,
-        'answer': answer,
-        'is_correct': is_correct,
-        'is_anonymous': poll.is_anonymous
-    }, room=f'class_{poll.class_id}')
+    today = now.date()
+    # Taps of a session that was already rolled up are counted into
+    # Participation now, and the class's grade summaries are rebuilt from
+    # the rows by the next gradebook view or rollup
+    late_classes = {
+        pending[key]['class_id'] for key in applied
+        if pending[key]['kind'] == 'interaction'
+        and (pending[key]['time'].date() < today or not known_classes[pending[key]['class_id']])
+    }
+    for class_id in late_classes:
+        with class_shard(class_id):
+            rollup_interactions(class_id)
+        GradeSummary.query.filter_by(class_id=class_id).delete()
+    db.session.commit()
+    
+    live_counts = {}
+    for key in applied:
+        item = pending[key]
+        if item['kind'] == 'interaction' and item['time'].date() == today:
+            live_key = (item['class_id'], item['type'])
+            live_counts[live_key] = live_counts.get(live_key, 0) + 1
+    for (class_id, interaction_type), count in live_counts.items():
+        update_live_state('interaction', class_id, type=interaction_type, count=count)
+    for poll, answer, is_correct in answers:
+        update_live_state('poll_response', poll.class_id, poll_id=poll.id, student_id=student_id, answer=answer)
+        socketio.emit('poll_response', {
+            'poll_id': poll.id,
+            'student_id': student_id,
+            'answer': answer,
+            'is_correct': is_correct,
+            'is_anonymous': poll.is_anonymous
+        }, room=instructor_room(poll.class_id))
+        # The nameplate showed no feedback for an answer it queued offline
+        socketio.emit('poll_answer_recorded', {
+            'poll_id': poll.id,
+            'answer': answer,
+            'is_correct': None if poll.is_anonymous else is_correct
+        }, room=student_room(student_id))
+    
+    for result in results:
+        if result['status'] is None:
+            key = result['key']
+            if key in applied_before:
+                result['status'] = 'duplicate'
+            elif key in errors:
+                result.update(status='rejected', error=errors[key])
+            else:
+                result['status'] = 'applied'
+    return results
+
+@app.route('/api/student/sync', methods=['POST'])
+def student_sync():
+    student_id = session.get('student_id')
+    if not student_id:
+        return jsonify({'success': False, 'error': 'Not logged in'})
     
-    return jsonify({'success': True, 'is_correct': is_correct})
+    data = request.get_json(silent=True) or {}
+    events = data.get('events')
+    if not isinstance(events, list):
+        return jsonify({'success': False, 'error': 'Events required'})
+    if len(events) > app.config['SYNC_MAX_EVENTS']:
+        return jsonify({'success': False, 'error': f"At most {app.config['SYNC_MAX_EVENTS']} events per request"})
+    
+    try:
+        results = sync_student_events(student_id, events)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+    return jsonify({'success': True, 'results': results})
 
 # SocketIO Events
 @socketio.on('connect')
 def on_connect():
     emit('connected', {'data': 'Connected'})
 
+# Students authenticate their socket once, with the token returned by login
+# or register. It is kept in the socket's own session, which the interaction
+# and poll answer events below read like the HTTP routes read theirs. Each
+# event's return value is sent back as its acknowledgement.
+def make_socket_token(student_id):
+    return URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='student-socket').dumps(student_id)
+
+@socketio.on('authenticate_student')
+def on_authenticate_student(data):
+    try:
+        student_id = URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='student-socket').loads(
+            data.get('token', ''), max_age=app.config['SOCKET_TOKEN_MAX_AGE']
+        )
+    except BadSignature:
+        return {'success': False, 'error': 'Invalid token'}
+    session['student_id'] = student_id
+    join_room(student_room(student_id))
+    return {'success': True}
+
+@socketio.on('send_interaction')
+def on_send_interaction(data):
+    student_id = session.get('student_id')
+    if not student_id:
+        return {'success': False, 'error': 'Not logged in'}
+    try:
+        return record_interaction(student_id, data)
+    except Exception as e:
+        db.session.rollback()
+        return {'success': False, 'error': str(e)}
+
+@socketio.on('send_poll_response')
+def on_send_poll_response(data):
+    student_id = session.get('student_id')
+    if not student_id:
+        return {'success': False, 'error': 'Not logged in'}
+    
+    result = record_poll_response(student_id, data.get('poll_id'), data.get('answer'))
+    if result is None:
+        return {'success': False, 'error': 'Poll not found'}
+    
+    return result
+
 @socketio.on('join_class')
 def on_join_class(data):
-    class_id = data.get('class_id')
-    join_room(f'class_{class_id}')
+    # The room is picked from who the socket belongs to: the professor who
+    # owns the class joins its instructor room, an enrolled student its
+    # students room.
+    try:
+        class_id = int(data.get('class_id'))
+    except (TypeError, ValueError):
+        return {'success': False, 'error': 'Invalid class ID'}
+    
+    if current_user.is_authenticated:
+        class_obj = db.session.get(Class, class_id)
+        if not class_obj or class_obj.professor_id != current_user.id:
+            return {'success': False, 'error': 'Unauthorized'}
+        join_room(instructor_room(class_id))
+    elif session.get('student_id'):
+        if not Enrollment.query.filter_by(class_id=class_id, student_id=session['student_id']).first():
+            return {'success': False, 'error': 'Not enrolled in this class'}
+        join_room(students_room(class_id))
+    else:
+        return {'success': False, 'error': 'Not logged in'}
+    
     emit('joined_class', {'class_id': class_id})
+    return {'success': True}
 
 @socketio.on('get_live_stats')
 def on_get_live_stats(data):
     class_id = data.get('class_id')
     
-    students = db.session.query(Student).join(Enrollment).filter(
-        Enrollment.class_id == class_id
-    ).all()
-    
-    today = datetime.utcnow().date()
-    present_students = db.session.query(Student).join(Attendance).filter(
-        Attendance.class_id == class_id,
-        Attendance.date == today,
-        Attendance.present == True
-    ).all()
-    
-    participations = Participation.query.filter_by(
-        class_id=class_id,
-        date=today
-    ).all()
-    
-    total_hand_raises = sum(p.hand_raises for p in participations)
-    total_thumbs_up = sum(p.thumbs_up for p in participations)
-    total_thumbs_down = sum(p.thumbs_down for p in participations)
+    state = get_live_state(class_id)
+    if not state:
+        class_obj = Class.query.get(class_id)
+        if not class_obj:
+            return
+        state = dashboard_live_state(class_obj)
     
-    active_poll = Poll.query.filter_by(class_id=class_id, is_active=True).first()
-    poll_stats = None
-    if active_poll:
-        responses = PollResponse.query.filter_by(poll_id=active_poll.id).all()
-        option_counts = {}
-        for i in range(len(json.loads(active_poll.options))):
-            option_counts[i] = sum(1 for r in responses if r.answer == i)
-        poll_stats = {
-            'poll_id': active_poll.id,
-            'question': active_poll.question,
-            'options': json.loads(active_poll.options),
-            'option_counts': option_counts,
-            'total_responses': len(responses),
-            'is_anonymous': active_poll.is_anonymous
-        }
-    
-    emit('live_stats', {
-        'total_students': len(students),
-        'present_students': len(present_students),
-        'total_hand_raises': total_hand_raises,
-        'total_thumbs_up': total_thumbs_up,
-        'total_thumbs_down': total_thumbs_down,
-        'poll_stats': poll_stats
-    })
+    emit('live_stats', state.snapshot())
+
+def init_database():
+    if app.config['SHARD_DIR']:
+        # Tables left in the catalog would hide the shards' tables of the same name
+        existing = [table.name for table in SHARDED_TABLES if inspect(db.engine).has_table(table.name)]
+        if existing:
+            raise RuntimeError(f"CLASSROOM_SHARD_DIR needs a database without the {', '.join(existing)} tables")
+        db.metadata.create_all(db.engine, tables=[table for table in db.metadata.sorted_tables if table not in SHARDED_TABLES])
+    else:
+        db.create_all()
+    migrate_database()
+    
+    # Create a default professor for testing
+    if not Professor.query.first():
+        default_prof = Professor(
+            username='professor',
+            email='prof@example.com',
+            password_hash=generate_password_hash('password')
+        )
+        db.session.add(default_prof)
+        db.session.commit()
 
 if __name__ == '__main__':
+    # Development server; use serve.py in production
     with app.app_context():
-        db.create_all()
-        
-        # Create a default professor for testing
-        if not Professor.query.first():
-            default_prof = Professor(
-                username='professor',
-                email='prof@example.com',
-                password_hash=generate_password_hash('password')
-            )
-            db.session.add(default_prof)
-            db.session.commit()
+        init_database()
     
+    # Exit cleanly on SIGTERM so buffered interactions are flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
+    start_job_runner()
     socketio.run(app, debug=True, host='0.0.0.0', port=5000)
-
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Data-layer benchmarks for the classroom app
+Seeds a synthetic semester into a temporary SQLite database and times the
+heavy handlers in app.py one at a time. It records the SQL statements each
+call issues. Results are written as JSON and can be compared against a stored
+baseline, so a change that brings back an N+1 query loop fails loudly.
+
+    python bench_data_layer.py --output bench.json
+    python bench_data_layer.py --baseline bench.json
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the data-layer hot paths of app.py.')
+    parser.add_argument('--students', type=int, default=3000, help='Students in the semester (default: 3000)')
+    parser.add_argument('--classes', type=int, default=30, help='Classes (default: 30)')
+    parser.add_argument('--class-size', type=int, default=100, help='Students enrolled per class (default: 100)')
+    parser.add_argument('--weeks', type=int, default=16, help='Weeks of history, two sessions a week (default: 16)')
+    parser.add_argument('--polls', type=int, default=2, help='Polls per session (default: 2)')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed calls per benchmark (default: 5)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the synthetic data (default: 1)')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare against results stored by an earlier --output run')
+    parser.add_argument('--time-tolerance', type=float, default=0.5,
+                        help='Allowed slowdown of the median time against the baseline (default: 0.5 = 50%%)')
+    return parser.parse_args(argv)
+
+# The app reads its configuration at import time
+DATA_DIR = tempfile.mkdtemp(prefix='classroom-bench-')
+os.environ['CLASSROOM_DATABASE_URI'] = f"sqlite:///{os.path.join(DATA_DIR, 'bench.db')}"
+os.environ.pop('CLASSROOM_MESSAGE_QUEUE', None)
+
+import app as classroom
+from sqlalchemy import event, insert
+
+app, db = classroom.app, classroom.db
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self.on_execute)
+
+    def on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+def insert_rows(model, rows, chunk=5000):
+    for start in range(0, len(rows), chunk):
+        db.session.execute(insert(model.__table__), rows[start:start + chunk])
+
+def seed_semester(args, reserved_classes):
+    """Students, classes, enrollments and a semester of sessions. The last
+    reserved_classes classes are left for the delete_class benchmark."""
+    rng = random.Random(args.seed)
+    today = datetime.utcnow().date()
+    start = today - timedelta(weeks=args.weeks)
+    session_dates = [start + timedelta(weeks=week, days=day) for week in range(args.weeks) for day in (0, 2)]
+    session_dates = [date for date in session_dates if date < today]
+
+    insert_rows(classroom.Student, [{
+        'student_number': f'B{i:06d}',
+        'first_name': 'Bench',
+        'last_name': f'Student {i}',
+        'rfid_card_id': f'BENCH-{i:06d}'
+    } for i in range(1, args.students + 1)])
+    insert_rows(classroom.Class, [{
+        'professor_id': 1,
+        'name': f'Bench class {i}',
+        'class_code': f'BENCH{i:03d}',
+        'is_active': False
+    } for i in range(1, args.classes + reserved_classes + 1)])
+
+    class_ids = [class_id for (class_id,) in db.session.query(classroom.Class.id).filter(
+        classroom.Class.class_code.like('BENCH%')
+    ).order_by(classroom.Class.id)]
+    student_ids = [student_id for (student_id,) in db.session.query(classroom.Student.id).filter(
+        classroom.Student.student_number.like('B%')
+    )]
+
+    for class_id in class_ids:
+        roster = rng.sample(student_ids, min(args.class_size, len(student_ids)))
+        insert_rows(classroom.Enrollment, [{'class_id': class_id, 'student_id': s} for s in roster])
+        attendance, participation, polls = [], [], []
+        for date in session_dates:
+            present = [s for s in roster if rng.random() < 0.85]
+            attendance += [{'class_id': class_id, 'student_id': s, 'date': date, 'present': True} for s in present]
+            participation += [{
+                'class_id': class_id,
+                'student_id': s,
+                'date': date,
+                'peer_grade': rng.uniform(0, 5),
+                'instructor_grade': rng.uniform(0, 5),
+                'hand_raises': rng.randrange(4),
+                'thumbs_up': rng.randrange(4),
+                'thumbs_down': rng.randrange(2)
+            } for s in roster]
+            for number in range(args.polls):
+                polls.append(({
+                    'class_id': class_id,
+                    'question': f'Question {number + 1}',
+                    'options': json.dumps(['A', 'B', 'C', 'D']),
+                    'correct_answer': 0,
+                    'is_active': False,
+                    'created_at': datetime.combine(date, datetime.min.time()) + timedelta(hours=10, minutes=number)
+                }, present))
+        insert_rows(classroom.Attendance, attendance)
+        insert_rows(classroom.Participation, participation)
+
+        responses = []
+        for poll, present in polls:
+            poll_id = db.session.execute(insert(classroom.Poll.__table__).values(**poll)).inserted_primary_key[0]
+            for s in present:
+                answer = rng.randrange(4)
+                responses.append({'poll_id': poll_id, 'student_id': s, 'answer': answer, 'is_correct': answer == 0})
+        insert_rows(classroom.PollResponse, responses)
+    db.session.commit()
+    return class_ids, student_ids
+
+def benchmark(call, repeat, counter, setup=None):
+    """Time call(i) for i = 1..repeat after one untimed warm-up call(0)"""
+    timings, queries = [], []
+    for i in range(repeat + 1):
+        if setup:
+            setup(i)
+        counter.count = 0
+        start = time.perf_counter()
+        call(i)
+        elapsed = time.perf_counter() - start
+        if i:
+            timings.append(elapsed)
+            queries.append(counter.count)
+    return {
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'min_ms': round(min(timings) * 1000, 3),
+        'max_ms': round(max(timings) * 1000, 3),
+        'queries': max(queries)
+    }
+
+def expect_ok(response):
+    if response.status_code != 200:
+        raise RuntimeError(f'{response.request.path} returned {response.status_code}')
+    data = response.get_json()
+    if isinstance(data, dict) and data.get('success') is False:
+        raise RuntimeError(f"{response.request.path} failed: {data.get('error')}")
+    return data
+
+def student_client(student_id):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['student_id'] = student_id
+    return client
+
+def run_benchmarks(args):
+    repeat = args.repeat
+    with app.app_context():
+        classroom.init_database()
+        print(f"🌱 Seeding {args.students} students, {args.classes} classes, {args.weeks} weeks...")
+        started = time.time()
+        class_ids, student_ids = seed_semester(args, reserved_classes=repeat + 1)
+        print(f"   seeded in {time.time() - started:.1f}s")
+        counter = QueryCounter(db.engine)
+
+    history_class = class_ids[1]
+    live_class = class_ids[0]
+    delete_classes = class_ids[-(repeat + 1):]
+    with app.app_context():
+        enrolled = {s for (s,) in db.session.query(classroom.Enrollment.student_id).filter_by(class_id=live_class)}
+    newcomers = [s for s in student_ids if s not in enrolled][:repeat + 1]
+    answerers = sorted(enrolled)[:repeat + 1]
+
+    # Jobs queued by the handlers are run by the benchmarks, not a runner thread
+    classroom.background_tasks.add(classroom.run_jobs.__name__)
+    professor = app.test_client()
+    professor.post('/login', data={'username': 'professor', 'password': 'password', 'user_type': 'professor'})
+    expect_ok(professor.post(f'/api/start_class/{live_class}'))
+    poll_id = expect_ok(professor.post(f'/api/create_poll/{live_class}', json={
+        'question': 'Bench question', 'options': ['A', 'B', 'C', 'D'], 'correct_answer': 0
+    }))['poll_id']
+    dashboard = classroom.socketio.test_client(app)
+
+    def update_gradebook(i):
+        with app.app_context():
+            classroom.update_gradebook(history_class)
+
+    def get_live_stats(i):
+        dashboard.emit('get_live_stats', {'class_id': live_class})
+        if not any(packet['name'] == 'live_stats' for packet in dashboard.get_received()):
+            raise RuntimeError('get_live_stats sent no live_stats')
+
+    def run_queued_job(i):
+        with app.app_context():
+            job = classroom.claim_next_job()
+            classroom.run_job(job)
+            if job.status != 'done':
+                raise RuntimeError(f'{job.kind} job failed: {job.error}')
+
+    def buffer_answers(i):
+        # One answer per student of the class to a fresh poll, like the burst
+        # that follows a question
+        with app.app_context():
+            classroom.poll_response_buffer.flush()
+            poll = classroom.Poll(class_id=live_class, question=f'Flush {i}', options='["A", "B", "C", "D"]', correct_answer=0)
+            db.session.add(poll)
+            db.session.commit()
+            for n, student_id in enumerate(sorted(enrolled)):
+                classroom.poll_response_buffer.add(poll.id, student_id, n % 4, n % 4 == 0)
+
+    def flush_answers(i):
+        with app.app_context():
+            if classroom.poll_response_buffer.flush() != len(enrolled):
+                raise RuntimeError('poll_response_buffer.flush wrote a partial batch')
+
+    students = {}
+    results = {}
+    print(f"⏱️  Running benchmarks ({repeat} timed calls each)...")
+    results['get_gradebook'] = benchmark(
+        lambda i: expect_ok(professor.get(f'/api/gradebook/{history_class}')), repeat, counter)
+    results['update_gradebook'] = benchmark(update_gradebook, repeat, counter)
+    results['on_get_live_stats'] = benchmark(get_live_stats, repeat, counter)
+    results['on_get_live_stats_cold'] = benchmark(
+        get_live_stats, repeat, counter, setup=lambda i: classroom.live_classes.pop(live_class, None))
+    results['student_join_class'] = benchmark(
+        lambda i: expect_ok(students[i].post('/api/student/join_class', json={'class_id': live_class})),
+        repeat, counter, setup=lambda i: students.__setitem__(i, student_client(newcomers[i])))
+    results['student_poll_response'] = benchmark(
+        lambda i: expect_ok(students[i].post('/api/student/poll_response', json={'poll_id': poll_id, 'answer': i % 4})),
+        repeat, counter, setup=lambda i: students.__setitem__(i, student_client(answerers[i])))
+    # The answers above are only buffered; the bulk insert is timed here
+    results['poll_response_flush'] = benchmark(flush_answers, repeat, counter, setup=buffer_answers)
+    results['delete_class'] = benchmark(
+        lambda i: expect_ok(professor.delete(f'/api/delete_class/{delete_classes[i]}')), repeat, counter)
+    results['delete_class_job'] = benchmark(run_queued_job, repeat, counter)
+    
+    # Answers buffered by the poll benchmark go to the database before it is removed
+    with app.app_context():
+        classroom.poll_response_buffer.flush()
+        db.engine.dispose()
+    return results
+
+def compare(results, baseline, time_tolerance):
+    """Print results next to the baseline and return the regressions"""
+    failures = []
+    print()
+    print(f"{'benchmark':<26}{'median ms':>11}{'baseline':>11}{'queries':>9}{'baseline':>10}")
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            print(f"{name:<26}{result['median_ms']:>11}{'-':>11}{result['queries']:>9}{'-':>10}")
+            continue
+        flag = ''
+        if result['queries'] > before['queries']:
+            failures.append(f"{name}: {before['queries']} → {result['queries']} queries per call")
+            flag = ' ❌'
+        # Ignore sub-millisecond noise
+        allowed = before['median_ms'] * (1 + time_tolerance)
+        if result['median_ms'] > allowed and result['median_ms'] - before['median_ms'] > 1:
+            failures.append(f"{name}: median {before['median_ms']}ms → {result['median_ms']}ms")
+            flag = ' ❌'
+        print(f"{name:<26}{result['median_ms']:>11}{before['median_ms']:>11}"
+              f"{result['queries']:>9}{before['queries']:>10}{flag}")
+    return failures
+
+def print_results(results):
+    print()
+    print(f"{'benchmark':<26}{'median ms':>11}{'min ms':>10}{'max ms':>10}{'queries':>9}")
+    for name, result in results.items():
+        print(f"{name:<26}{result['median_ms']:>11}{result['min_ms']:>10}{result['max_ms']:>10}{result['queries']:>9}")
+
+def main(argv=None):
+    args = parse_args(argv)
+    params = {key: getattr(args, key) for key in ('students', 'classes', 'class_size', 'weeks', 'polls', 'repeat', 'seed')}
+    try:
+        results = run_benchmarks(args)
+    finally:
+        shutil.rmtree(DATA_DIR, ignore_errors=True)
+
+    report = {'params': params, 'python': sys.version.split()[0], 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if not args.baseline:
+        print_results(results)
+        if args.output:
+            print(f"\n💾 Results written to {args.output}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('params') != params:
+        print(f"⚠️  Baseline was recorded with different parameters: {baseline.get('params')}")
+    failures = compare(results, baseline.get('results', {}), args.time_tolerance)
+    if failures:
+        print("\n❌ Regressions against the baseline:")
+        for failure in failures:
+            print(f"   {failure}")
+        return 1
+    print("\n✅ No regressions against the baseline")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Multi-worker check for the classroom app
+Runs two workers in one process on the in-process local:// message queue: the
+app itself and a second Socket.IO server subscribed to the same channel. It
+checks that room broadcasts and live class state changes published by either
+worker reach the other one, which is what a Redis or Kombu deployment relies
+on. Needs no broker.
+
+    python check_message_queue.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+# The app reads its configuration at import time
+DATA_DIR = tempfile.mkdtemp(prefix='classroom-mq-')
+os.environ['CLASSROOM_DATABASE_URI'] = f"sqlite:///{os.path.join(DATA_DIR, 'check.db')}"
+os.environ['CLASSROOM_MESSAGE_QUEUE'] = 'local://'
+os.environ.pop('CLASSROOM_SHARD_DIR', None)
+
+import socketio
+from werkzeug.security import generate_password_hash
+
+import app as classroom
+
+app, db = classroom.app, classroom.db
+
+class OtherWorker(classroom.LocalPubSubManager):
+    """The second worker's queue manager. It keeps what reaches it instead of
+    delivering it to clients."""
+    def __init__(self):
+        super().__init__(channel='classroom')
+        self.received = []
+
+    def _handle_emit(self, message):
+        self.received.append(message)
+
+    def events(self, event):
+        return [message['data'] for message in self.received if message['event'] == event]
+
+def wait_for(condition, timeout=2.0):
+    waited = 0.0
+    while not condition():
+        if waited >= timeout:
+            return False
+        classroom.socketio.sleep(0.05)
+        waited += 0.05
+    return True
+
+def seed_class():
+    with app.app_context():
+        db.create_all()
+        professor = classroom.Professor(username='check', email='check@example.com',
+                                        password_hash=generate_password_hash('check'))
+        db.session.add(professor)
+        db.session.flush()
+        class_obj = classroom.Class(professor_id=professor.id, name='Queue check', class_code='MQ1')
+        db.session.add(class_obj)
+        db.session.commit()
+        return class_obj.id
+
+def run_checks():
+    class_id = seed_class()
+    server = classroom.socketio.server
+    if not server.manager_initialized:
+        # A server starts listening on the queue at its first connection
+        server.manager_initialized = True
+        server.manager.initialize()
+    other = OtherWorker()
+    socketio.Server(client_manager=other, async_mode=server.async_mode)
+    other.initialize()
+
+    # A client of the app sits in the class's instructor room
+    delivered = []
+    sid = server.manager.connect('check-client', '/')
+    server.manager.enter_room(sid, '/', classroom.instructor_room(class_id))
+    send_packet = server.eio.send_packet
+    server.eio.send_packet = lambda eio_sid, packet: delivered.append(packet) if eio_sid == 'check-client' else send_packet(eio_sid, packet)
+
+    failures = []
+    def check(name, passed):
+        print(f"{'✅' if passed else '❌'} {name}")
+        if not passed:
+            failures.append(name)
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'check', 'password': 'check'})
+    started = client.post(f'/api/start_class/{class_id}').get_json() or {}
+    check('Class starts in multi-worker mode', started.get('success') is True)
+
+    check('Live state published by the app reaches the other worker',
+          wait_for(lambda: any(update['op'] == 'start' and update['class_id'] == class_id
+                               for update in other.events(classroom.LIVE_UPDATE_EVENT))))
+
+    classroom.socketio.emit('student_interaction', {'class_id': class_id, 'type': 'hand_raise'},
+                            room=classroom.instructor_room(class_id))
+    check('Room broadcast from the app reaches the other worker',
+          wait_for(lambda: other.events('student_interaction')))
+
+    other.emit(classroom.LIVE_UPDATE_EVENT, {'op': 'interaction', 'class_id': class_id, 'type': 'thumbs_up'},
+               namespace='/', room=classroom.LIVE_UPDATE_ROOM)
+    state = classroom.get_live_state(class_id)
+    check('Live state published by the other worker is applied by the app',
+          wait_for(lambda: state is not None and state.total_thumbs_up == 1))
+
+    other.emit('poll_started', {'class_id': class_id}, namespace='/', room=classroom.instructor_room(class_id))
+    check("Room broadcast from the other worker reaches the app's clients",
+          wait_for(lambda: any('poll_started' in str(packet.data) for packet in delivered)))
+
+    client.post(f'/api/stop_class/{class_id}')
+    return failures
+
+def main():
+    try:
+        failures = run_checks()
+    finally:
+        shutil.rmtree(DATA_DIR, ignore_errors=True)
+    if failures:
+        print(f"\n❌ {len(failures)} check(s) failed")
+        return 1
+    print("\n✅ Both workers see each other's broadcasts and live state")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+"""
+Load test for the classroom app
+Simulates a lecture hall of nameplates (students) and faculty dashboards
+against a running server, or against a throwaway local server on a temporary
+SQLite database, and reports latency percentiles, throughput, error rates and
+broadcast fan-out delay.
+
+Needs the Socket.IO client extras: pip install "python-socketio[client]"
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from urllib.parse import urlencode, urlparse
+
+try:
+    import requests  # noqa: F401  (used by the Socket.IO client)
+    import websocket  # noqa: F401
+    import socketio
+except ImportError:
+    socketio = None
+
+INTERACTION_TYPES = ('hand_raise', 'thumbs_up', 'thumbs_down')
+
+class Recorder:
+    """Thread-safe collection of timings and errors"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.fanout = defaultdict(list)
+
+    def record(self, operation, seconds, ok=True):
+        with self.lock:
+            self.latencies[operation].append(seconds)
+            if not ok:
+                self.errors[operation] += 1
+
+    def record_fanout(self, event, seconds):
+        with self.lock:
+            self.fanout[event].append(seconds)
+
+    def timed(self, operation, call):
+        """Run call(), record its latency, and count it as an error when it
+        raises or returns a response without success"""
+        start = time.perf_counter()
+        try:
+            result = call()
+        except Exception:
+            self.record(operation, time.perf_counter() - start, ok=False)
+            return None
+        ok = not isinstance(result, dict) or result.get('success', True)
+        self.record(operation, time.perf_counter() - start, ok=ok)
+        return result
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(p / 100.0 * len(values))) - 1))
+    return values[index]
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 50) * 1000, 2),
+        'p95_ms': round(percentile(values, 95) * 1000, 2),
+        'p99_ms': round(percentile(values, 99) * 1000, 2),
+        'max_ms': round(max(values) * 1000, 2) if values else 0.0
+    }
+
+class HttpSession:
+    """Minimal cookie-keeping HTTP client (standard library only)"""
+    def __init__(self, base_url, timeout=10):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+
+    def request(self, method, path, json_body=None, form=None):
+        headers = {}
+        data = None
+        if json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            data = urlencode(form).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                body = response.read()
+                content_type = response.headers.get('Content-Type', '')
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(f'{method} {path} returned {e.code}')
+        if 'application/json' in content_type:
+            return json.loads(body)
+        return {'success': True}
+
+    def post(self, path, json_body=None, form=None):
+        return self.request('POST', path, json_body=json_body, form=form)
+
+    def cookie_header(self):
+        return '; '.join(f'{cookie.name}={cookie.value}' for cookie in self.cookies)
+
+class Professor:
+    """Sets up the class, starts polls and tears everything down"""
+    def __init__(self, args, recorder):
+        self.args = args
+        self.recorder = recorder
+        self.http = HttpSession(args.url)
+        self.class_id = None
+        self.poll_started_at = {}
+
+    def setup(self):
+        self.http.post('/login', form={
+            'username': self.args.professor,
+            'password': self.args.password,
+            'user_type': 'professor'
+        })
+        code = f'LOAD{int(time.time())}'
+        result = self.http.post('/api/create_class', json_body={'name': f'Load test {code}', 'class_code': code})
+        if not result.get('success'):
+            raise RuntimeError(f"Could not create the class: {result.get('error', 'professor login failed?')}")
+        self.class_id = result['class_id']
+        result = self.recorder.timed('start_class', lambda: self.http.post(f'/api/start_class/{self.class_id}'))
+        if not result or not result.get('success'):
+            raise RuntimeError('Could not start the class')
+
+    def start_poll(self, number):
+        options = [f'Option {i + 1}' for i in range(self.args.poll_options)]
+        started = time.time()
+        result = self.recorder.timed('create_poll', lambda: self.http.post(
+            f'/api/create_poll/{self.class_id}',
+            json_body={'question': f'Question {number}', 'options': options, 'correct_answer': 0}
+        ))
+        if result and result.get('success'):
+            self.poll_started_at[result['poll_id']] = started
+            return result['poll_id']
+        return None
+
+    def stop_poll(self, poll_id):
+        self.recorder.timed('stop_poll', lambda: self.http.post(f'/api/stop_poll/{poll_id}'))
+
+    def teardown(self):
+        self.recorder.timed('stop_class', lambda: self.http.post(f'/api/stop_class/{self.class_id}'))
+        self.recorder.timed('get_gradebook', lambda: self.http.request('GET', f'/api/gradebook/{self.class_id}'))
+        if not self.args.keep_class:
+            self.recorder.timed('delete_class', lambda: self.http.request('DELETE', f'/api/delete_class/{self.class_id}'))
+
+class SimulatedStudent:
+    """One nameplate: logs in with its RFID card, joins the class and then
+    taps and answers polls over its socket"""
+    def __init__(self, index, args, recorder, professor, interaction_log):
+        self.index = index
+        self.args = args
+        self.recorder = recorder
+        self.professor = professor
+        self.interaction_log = interaction_log
+        self.http = HttpSession(args.url)
+        self.student_id = None
+        self.sio = None
+        self.pending_poll = None
+        self.lock = threading.Lock()
+
+    def register(self):
+        number = f'LT{self.index:04d}'
+        result = self.http.post('/api/student/register', json_body={
+            'student_number': number,
+            'first_name': 'Load',
+            'last_name': f'Student {self.index}',
+            'rfid_card_id': f'LT-RFID-{self.index:04d}'
+        })
+        # Students left over from an earlier run are reused
+        if not result.get('success') and 'exists' not in result.get('error', ''):
+            raise RuntimeError(result.get('error'))
+
+    def connect(self):
+        result = self.recorder.timed('student_login', lambda: self.http.post(
+            '/api/student/login', json_body={'rfid_card_id': f'LT-RFID-{self.index:04d}'}
+        ))
+        if not result or not result.get('success'):
+            return False
+        self.student_id = result['student']['id']
+        socket_token = result.get('socket_token', '')
+        result = self.recorder.timed('student_join_class', lambda: self.http.post(
+            '/api/student/join_class', json_body={'class_id': self.professor.class_id}
+        ))
+        if not result or not result.get('success'):
+            return False
+
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('poll_started', self.on_poll_started)
+        start = time.perf_counter()
+        try:
+            self.sio.connect(self.args.url, transports=[self.args.transport],
+                             headers={'Cookie': self.http.cookie_header()}, wait_timeout=10)
+        except Exception:
+            self.recorder.record('socket_connect', time.perf_counter() - start, ok=False)
+            return False
+        self.recorder.record('socket_connect', time.perf_counter() - start)
+        self.call('authenticate_student', {'token': socket_token})
+        self.sio.emit('join_class', {'class_id': self.professor.class_id})
+        return True
+
+    def call(self, event, data):
+        return self.recorder.timed(event, lambda: self.sio.call(event, data, timeout=self.args.timeout))
+
+    def on_poll_started(self, data):
+        started = self.professor.poll_started_at.get(data.get('poll_id'))
+        if started:
+            self.recorder.record_fanout('poll_started', time.time() - started)
+        if random.random() < self.args.answer_rate:
+            with self.lock:
+                self.pending_poll = (time.time() + random.uniform(0, self.args.answer_window),
+                                     data['poll_id'], len(data.get('options', [])))
+
+    def run(self, deadline):
+        next_tap = time.time() + random.expovariate(self.args.interaction_rate) if self.args.interaction_rate else None
+        while time.time() < deadline:
+            now = time.time()
+            if next_tap and now >= next_tap:
+                interaction_type = random.choice(self.args.interaction_types)
+                self.interaction_log.sent(self.student_id, time.time())
+                self.call('send_interaction', {'class_id': self.professor.class_id, 'type': interaction_type})
+                next_tap = now + random.expovariate(self.args.interaction_rate)
+            with self.lock:
+                poll = self.pending_poll
+                if poll and now >= poll[0]:
+                    self.pending_poll = None
+                else:
+                    poll = None
+            if poll:
+                self.call('send_poll_response', {'poll_id': poll[1], 'answer': random.randrange(max(poll[2], 1))})
+            time.sleep(0.02)
+
+    def close(self):
+        if self.sio:
+            self.sio.disconnect()
+
+class InteractionLog:
+    """Send times of each student's taps, so dashboards can work out how long
+    the matching student_interaction broadcast took to reach them"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent_times = defaultdict(list)
+
+    def sent(self, student_id, at):
+        with self.lock:
+            self.sent_times[student_id].append(at)
+
+    def sent_at(self, student_id, number):
+        with self.lock:
+            times = self.sent_times.get(student_id, [])
+            return times[number] if number < len(times) else None
+
+class SimulatedDashboard:
+    """A faculty dashboard: watches the instructor room and asks for the full
+    live stats every --stats-interval seconds"""
+    def __init__(self, args, recorder, professor, interaction_log):
+        self.args = args
+        self.recorder = recorder
+        self.professor = professor
+        self.interaction_log = interaction_log
+        self.seen = defaultdict(int)
+        self.stats_received = threading.Event()
+        self.sio = None
+
+    def connect(self):
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('live_stats', lambda data: self.stats_received.set())
+        self.sio.on('student_interaction', self.on_student_interaction)
+        # The professor's session cookie puts the socket in the instructor room
+        self.sio.connect(self.args.url, transports=[self.args.transport],
+                         headers={'Cookie': self.professor.http.cookie_header()}, wait_timeout=10)
+        self.sio.emit('join_class', {'class_id': self.professor.class_id})
+
+    def on_student_interaction(self, data):
+        student_id = data.get('student_id')
+        sent = self.interaction_log.sent_at(student_id, self.seen[student_id])
+        self.seen[student_id] += 1
+        if sent:
+            self.recorder.record_fanout('student_interaction', time.time() - sent)
+
+    def run(self, deadline):
+        while time.time() < deadline:
+            self.stats_received.clear()
+            start = time.perf_counter()
+            self.sio.emit('get_live_stats', {'class_id': self.professor.class_id})
+            ok = self.stats_received.wait(self.args.timeout)
+            self.recorder.record('get_live_stats', time.perf_counter() - start, ok=ok)
+            if self.args.stats_interval <= 0:
+                break
+            time.sleep(self.args.stats_interval)
+
+    def close(self):
+        if self.sio:
+            self.sio.disconnect()
+
+def start_local_server(port):
+    """Start serve.py on a temporary SQLite database. Returns the server
+    process and the directory holding the database."""
+    directory = tempfile.mkdtemp(prefix='classroom-loadtest-')
+    env = dict(
+        os.environ,
+        CLASSROOM_DATABASE_URI=f"sqlite:///{os.path.join(directory, 'loadtest.db')}",
+        CLASSROOM_HOST='127.0.0.1',
+        CLASSROOM_PORT=str(port)
+    )
+    env.pop('CLASSROOM_MESSAGE_QUEUE', None)
+    env.pop('CLASSROOM_WORKERS', None)
+    if env.get('CLASSROOM_SHARD_DIR'):
+        env['CLASSROOM_SHARD_DIR'] = os.path.join(directory, 'shards')
+    server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'serve.py')],
+                              env=env, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if server.poll() is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise RuntimeError('The local server exited during startup')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server, directory
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    server.wait(timeout=30)
+    shutil.rmtree(directory, ignore_errors=True)
+    raise RuntimeError('The local server did not start within 30 seconds')
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def run_parallel(items, target, concurrency):
+    """Call target(item) for every item, with at most concurrency in flight"""
+    results = [None] * len(items)
+    semaphore = threading.Semaphore(concurrency)
+
+    def worker(index, item):
+        with semaphore:
+            try:
+                results[index] = target(item)
+            except Exception:
+                results[index] = None
+
+    threads = [threading.Thread(target=worker, args=(i, item), daemon=True) for i, item in enumerate(items)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def run_load_test(args):
+    recorder = Recorder()
+    interaction_log = InteractionLog()
+    professor = Professor(args, recorder)
+    professor.setup()
+
+    students = [SimulatedStudent(i, args, recorder, professor, interaction_log) for i in range(args.students)]
+    print(f"👥 Registering {args.students} students...")
+    run_parallel(students, lambda student: student.register(), args.concurrency)
+
+    # Nameplates come online over the ramp-up period, like students walking in
+    print(f"🚪 Connecting students over {args.ramp}s...")
+    ramp_start = time.time()
+
+    def connect_student(student):
+        time.sleep(random.uniform(0, args.ramp))
+        return student.connect()
+
+    connected = run_parallel(students, connect_student, args.students or 1)
+    students = [student for student, ok in zip(students, connected) if ok]
+    print(f"✅ {len(students)} students connected in {time.time() - ramp_start:.1f}s")
+
+    dashboards = [SimulatedDashboard(args, recorder, professor, interaction_log) for _ in range(args.dashboards)]
+    for dashboard in dashboards:
+        dashboard.connect()
+
+    print(f"⏱️  Running for {args.duration}s...")
+    start = time.time()
+    deadline = start + args.duration
+    threads = [threading.Thread(target=client.run, args=(deadline,), daemon=True) for client in students + dashboards]
+    for thread in threads:
+        thread.start()
+
+    poll_number = 0
+    while args.poll_interval > 0 and time.time() + args.poll_interval <= deadline:
+        time.sleep(args.poll_interval)
+        poll_number += 1
+        poll_id = professor.start_poll(poll_number)
+        if poll_id:
+            time.sleep(min(args.answer_window + 1, max(0, deadline - time.time())))
+            professor.stop_poll(poll_id)
+
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    time.sleep(0.5)  # let the last broadcasts arrive
+
+    for client in students + dashboards:
+        try:
+            client.close()
+        except Exception:
+            pass
+    professor.teardown()
+    return recorder, elapsed, len(students)
+
+def build_report(args, recorder, elapsed, connected):
+    operations = {}
+    for operation, values in sorted(recorder.latencies.items()):
+        operations[operation] = {
+            **summarize(values),
+            'errors': recorder.errors.get(operation, 0),
+            'error_rate': round(recorder.errors.get(operation, 0) / len(values), 4) if values else 0.0,
+            'per_second': round(len(values) / elapsed, 2) if elapsed else 0.0
+        }
+    total = sum(len(values) for values in recorder.latencies.values())
+    errors = sum(recorder.errors.values())
+    return {
+        'students': args.students,
+        'students_connected': connected,
+        'dashboards': args.dashboards,
+        'duration_s': round(elapsed, 2),
+        'requests': total,
+        'errors': errors,
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'operations': operations,
+        'fanout': {event: summarize(values) for event, values in sorted(recorder.fanout.items())}
+    }
+
+def print_report(report):
+    print()
+    print(f"📊 {report['students_connected']}/{report['students']} students, {report['dashboards']} dashboards, "
+          f"{report['duration_s']}s, {report['requests']} requests, error rate {report['error_rate']:.2%}")
+    print()
+    print(f"{'operation':<22}{'count':>8}{'/s':>9}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for operation, stats in report['operations'].items():
+        print(f"{operation:<22}{stats['count']:>8}{stats['per_second']:>9}{stats['errors']:>8}"
+              f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+    if report['fanout']:
+        print()
+        print(f"{'fan-out delay':<22}{'count':>8}{'':>17}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for event, stats in report['fanout'].items():
+            print(f"{event:<22}{stats['count']:>8}{'':>17}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Simulate a lecture hall of nameplates against the classroom app.')
+    parser.add_argument('--url', help='Server to test (default: start serve.py on a temporary SQLite database)')
+    parser.add_argument('--students', type=int, default=50, help='Simulated nameplates (default: 50)')
+    parser.add_argument('--dashboards', type=int, default=1, help='Simulated faculty dashboards (default: 1)')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds of load after everyone has joined (default: 30)')
+    parser.add_argument('--ramp', type=float, default=5, help='Seconds over which students join (default: 5)')
+    parser.add_argument('--interaction-rate', type=float, default=0.1,
+                        help='Taps per student per second (default: 0.1)')
+    parser.add_argument('--interaction-types', default=','.join(INTERACTION_TYPES),
+                        help='Comma-separated interaction types to send (default: all)')
+    parser.add_argument('--poll-interval', type=float, default=10,
+                        help='Seconds between polls, 0 for none (default: 10)')
+    parser.add_argument('--poll-options', type=int, default=4, help='Options per poll (default: 4)')
+    parser.add_argument('--answer-rate', type=float, default=1.0,
+                        help='Fraction of students who answer each poll (default: 1.0)')
+    parser.add_argument('--answer-window', type=float, default=5,
+                        help='Students answer within this many seconds of a poll starting (default: 5)')
+    parser.add_argument('--stats-interval', type=float, default=5,
+                        help='Seconds between get_live_stats requests per dashboard, 0 for once (default: 5)')
+    parser.add_argument('--transport', choices=['websocket', 'polling'], default='websocket')
+    parser.add_argument('--concurrency', type=int, default=20, help='Parallel requests during setup (default: 20)')
+    parser.add_argument('--timeout', type=float, default=10, help='Seconds before a request counts as failed')
+    parser.add_argument('--professor', default='professor', help='Professor username (default: professor)')
+    parser.add_argument('--password', default='password', help='Professor password (default: password)')
+    parser.add_argument('--keep-class', action='store_true', help='Do not delete the load-test class afterwards')
+    parser.add_argument('--json', help='Also write the report to this file')
+    parser.add_argument('--max-error-rate', type=float, default=0.01,
+                        help='Exit with status 1 when the error rate is higher (default: 0.01)')
+    args = parser.parse_args(argv)
+    args.interaction_types = [t for t in args.interaction_types.split(',') if t]
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    if socketio is None:
+        print('❌ loadtest.py needs the Socket.IO client extras: pip install "python-socketio[client]"')
+        return 2
+
+    server = data_dir = None
+    if not args.url:
+        port = free_port()
+        print(f"🎓 Starting a local server on port {port} with a temporary SQLite database...")
+        server, data_dir = start_local_server(port)
+        args.url = f'http://127.0.0.1:{port}'
+    elif not urlparse(args.url).scheme:
+        args.url = f'http://{args.url}'
+
+    try:
+        recorder, elapsed, connected = run_load_test(args)
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=30)
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = build_report(args, recorder, elapsed, connected)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Report written to {args.json}")
+
+    if report['error_rate'] > args.max_error_rate:
+        print(f"❌ Error rate {report['error_rate']:.2%} is above {args.max_error_rate:.2%}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Production server for the classroom app
+Runs Flask-SocketIO on an eventlet (or gevent) worker with debug and the
+reloader off. All settings come from environment variables (see README.md).
+"""
+
+import os
+
+ASYNC_MODE = os.environ.setdefault('CLASSROOM_ASYNC_MODE', 'eventlet')
+
+# Sockets, threads and timers must be patched before anything else imports them
+if ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+else:
+    raise SystemExit(f"CLASSROOM_ASYNC_MODE must be 'eventlet' or 'gevent', not '{ASYNC_MODE}'")
+
+import signal
+import subprocess
+import sys
+
+from app import app, socketio, init_database, start_job_runner
+
+def server_options(max_connections):
+    """Concurrency limit for the async worker"""
+    if ASYNC_MODE == 'eventlet':
+        # Size of the green thread pool that serves requests and sockets
+        return {'max_size': max_connections}
+    from gevent.pool import Pool
+    return {'spawn': Pool(max_connections)}
+
+def run_workers(workers, port):
+    """Start one worker process per port from port to port + workers - 1.
+    Put a load balancer with sticky sessions in front of them."""
+    message_queue = os.environ.get('CLASSROOM_MESSAGE_QUEUE', '')
+    if not message_queue or message_queue.startswith('local://'):
+        print("❌ CLASSROOM_WORKERS > 1 needs a shared CLASSROOM_MESSAGE_QUEUE (e.g. redis://localhost:6379/0)")
+        return 1
+
+    processes = []
+    for index in range(workers):
+        env = dict(os.environ, CLASSROOM_WORKER_INDEX=str(index), CLASSROOM_PORT=str(port + index))
+        processes.append(subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env))
+
+    def stop(signum, frame):
+        for process in processes:
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"🎓 Started {workers} workers on ports {port}-{port + workers - 1}")
+    return max(process.wait() for process in processes)
+
+def main():
+    host = os.environ.get('CLASSROOM_HOST', '0.0.0.0')
+    port = int(os.environ.get('CLASSROOM_PORT', 5000))
+    max_connections = int(os.environ.get('CLASSROOM_MAX_CONNECTIONS', 1000))
+    workers = int(os.environ.get('CLASSROOM_WORKERS', 1))
+
+    # Workers started by run_workers() leave setup to their parent
+    if 'CLASSROOM_WORKER_INDEX' not in os.environ:
+        with app.app_context():
+            init_database()
+        if workers > 1:
+            return run_workers(workers, port)
+
+    # Exit cleanly on SIGTERM (systemd stop) so buffered interactions are flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    start_job_runner()
+    print(f"🎓 Serving on http://{host}:{port} ({ASYNC_MODE}, up to {max_connections} connections)")
+    socketio.run(app, host=host, port=port, debug=False, use_reloader=False,
+                 log_output=False, **server_options(max_connections))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
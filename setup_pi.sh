@@ -96,7 +96,7 @@ echo "📱 Student interface: http://$IP:5000/student"
 echo ""
 echo "Press Ctrl+C to stop"
 echo ""
-python3 app.py
+python3 serve.py
 EOF
 
 chmod +x ~/start_classroom.sh
@@ -117,7 +117,7 @@ echo "🚀 To start the app, run:"
 echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
 echo ""
 echo "  cd ~/IntelligentNameplate"
-echo "  python3 app.py"
+echo "  python3 serve.py"
 echo ""
 echo "  OR use the quick start script:"
 echo "  ~/start_classroom.sh"
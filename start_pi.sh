@@ -29,6 +29,6 @@ echo ""
 echo "Press Ctrl+C to stop the server"
 echo ""
 
-# Start the app
-python3 app.py
+# Start the app (production server; use python3 app.py for the debug server)
+python3 serve.py
 